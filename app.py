@@ -1,419 +1,665 @@
 import argparse
-import mimetypes
-from google import genai
-from google.genai import types
+import asyncio
 import os
-from flask import Flask, request, jsonify, send_from_directory, render_template
-from werkzeug.utils import secure_filename
+from flask import Flask, Request, Response, request, jsonify, send_from_directory, render_template
 import json
+import sys
 import tempfile
 
+from async_engine import QuotaExceeded, get_engine
+import bboxes
+from batch import collect_inputs, run_batch
+from cache import get_cache, make_key
+from chunking import extract_chunked
+from compact import expand, expand_row, expand_text
+from documents import page_sizes, read_document, sniff_mime_type, spool, try_page_count
+from extractor import get_extractor
+from jobs import JobQueue, QueueFull
+from jsonstream import LineItemParser
+import metrics
+import preflight
+import routing
+import textlayer
+from resilience import DeadlineExceeded
+
+class SpooledRequest(Request):
+    """Request that buffers file uploads in memory up to ``UPLOAD_SPOOL_MAX_MEMORY``."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=app.config['UPLOAD_SPOOL_MAX_MEMORY'])
+
 app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()
+app.request_class = SpooledRequest
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Uploads larger than this spill from memory to an anonymous temporary file
+app.config['UPLOAD_SPOOL_MAX_MEMORY'] = int(os.environ.get('UPLOAD_SPOOL_MAX_MEMORY', 4 * 1024 * 1024))
+# Split PDFs longer than this many pages into concurrently extracted chunks (0 disables)
+app.config['CHUNK_PAGES'] = int(os.environ.get('CHUNK_PAGES', 0))
+app.config['CHUNK_WORKERS'] = int(os.environ.get('CHUNK_WORKERS', 4))
+# Background extraction jobs submitted through /jobs
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_QUEUE_SIZE'] = int(os.environ.get('JOB_QUEUE_SIZE', 16))
+app.config['JOB_RETENTION'] = int(os.environ.get('JOB_RETENTION', 3600))  # seconds
+# Ask the model for the compact row format and expand it server-side
+app.config['COMPACT_OUTPUT'] = os.environ.get('COMPACT_OUTPUT') == '1'
+# Route model calls through the rate-limited AsyncEngine (see async_engine.py)
+app.config['ASYNC_ENGINE'] = os.environ.get('ASYNC_ENGINE') == '1'
+# Drop blank and duplicate PDF pages (and optionally downsample scans) before the model call
+app.config['PREFLIGHT'] = os.environ.get('PREFLIGHT') == '1'
+app.config['PREFLIGHT_TARGET_DPI'] = int(os.environ.get('PREFLIGHT_TARGET_DPI', 0))
+# Resolve boxes of born-digital PDFs from their text layer; the model returns values only
+app.config['TEXT_LAYER'] = os.environ.get('TEXT_LAYER') == '1'
+# Clamp and repair bounding boxes before responding (see bboxes.py; needs numpy)
+app.config['BBOX_POSTPROCESS'] = os.environ.get('BBOX_POSTPROCESS', '1') == '1'
+# Drop line items overlapping an earlier one on the same page; 0 disables deduplication
+app.config['BBOX_IOU_THRESHOLD'] = float(os.environ.get('BBOX_IOU_THRESHOLD', bboxes.DEFAULT_IOU_THRESHOLD))
 
 ALLOWED_EXTENSIONS = {'pdf'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def generate(file_path):
+def query_flag(req, name):
+    """Reads a boolean query parameter; returns None when it is absent."""
+    if name not in req.args:
+        return None
+    return req.args[name].lower() in ('1', 'true', 'yes')
+
+def cache_bypassed(req):
+    """Whether the client asked to skip the result cache (``?nocache=1`` or ``Cache-Control: no-cache``)."""
+    if query_flag(req, 'nocache'):
+        return True
+    return 'no-cache' in req.headers.get('Cache-Control', '').lower()
+
+def current_extractor():
+    """The async engine when ``ASYNC_ENGINE`` is enabled, otherwise the plain extractor."""
+    if app.config['ASYNC_ENGINE']:
+        return get_engine()
+    return get_extractor()
+
+def quota_exceeded_response(e):
+    response = jsonify({'error': 'Model quota exceeded. Please retry later.'})
+    response.headers['Retry-After'] = str(int(e.retry_after))
+    return response, 429
+
+def prepare_document(file_bytes, mime_type):
+    """
+    Runs PDF preflight (see ``preflight.py``) when it is enabled.
+
+    Returns:
+        tuple: ``(model_bytes, page_map, report)``; ``page_map`` and
+        ``report`` are None when preflight did not run or could not parse
+        the document, which then goes to the model unchanged.
+    """
+    if not (app.config['PREFLIGHT'] and mime_type == 'application/pdf' and preflight.available()):
+        return file_bytes, None, None
+    try:
+        with metrics.timed('preflight'):
+            model_bytes, page_map, report = preflight.preflight(file_bytes, target_dpi=app.config['PREFLIGHT_TARGET_DPI'])
+    except Exception:
+        # The model often reads PDFs pypdf cannot parse
+        return file_bytes, None, None
+    metrics.record_preflight(report)
+    return model_bytes, page_map, report
+
+def preflight_fingerprint(mime_type):
+    """Cache key suffix for the preflight settings, which change what the model sees."""
+    if not (app.config['PREFLIGHT'] and mime_type == 'application/pdf' and preflight.available()):
+        return ''
+    return f":preflight={app.config['PREFLIGHT_TARGET_DPI']}"
+
+def extract_text_layer(extractor, model_bytes, mime_type):
+    """
+    Extracts a PDF through its text layer (see ``textlayer.py``).
+
+    Returns:
+        dict: The result with boxes resolved from the text layer, or None
+        when the document has no usable text layer or cannot be parsed.
+    """
+    with metrics.timed('text_layer'):
+        try:
+            pages = textlayer.extract_words(model_bytes)
+        except Exception:
+            # The model often reads PDFs the text layer reader cannot parse
+            pages = None
+    if not pages or not textlayer.usable(pages):
+        metrics.record_text_layer(None)
+        return None
+    response = json.loads(extractor.generate(model_bytes, mime_type, 'text'))
+    with metrics.timed('text_layer'):
+        result_data, stats = textlayer.resolve(response, pages)
+    metrics.record_text_layer(stats)
+    result_data['textLayer'] = stats
+    return result_data
+
+def generate(source, use_cache=True, chunk_pages=None, max_workers=None, compact=None, text_layer=None):
   """
   Generates content from a given file using the Gemini model.
 
+  Results are cached by file content, model, prompt and schema; identical
+  documents submitted concurrently share a single model call.
+
   Args:
-      file_path (str): The path to the image or PDF file.
+      source (str | bytes | file): The path to the image or PDF file, its
+          contents, or a file-like object to read it from.
+      use_cache (bool): Set to False to force a fresh model call.
+      chunk_pages (int): Extract PDFs longer than this many pages in
+          concurrent page ranges. Defaults to ``CHUNK_PAGES``; 0 disables.
+      max_workers (int): Concurrent model calls when chunking. Defaults to
+          ``CHUNK_WORKERS``.
+      compact (bool): Have the model emit the compact row format, which is
+          expanded to the same JSON shape. Defaults to ``COMPACT_OUTPUT``.
+      text_layer (bool): For PDFs with a usable text layer, ask the model
+          for values only and take the boxes from the text layer; other
+          documents, and all documents without PyMuPDF, fall back to the
+          options above. Defaults to ``TEXT_LAYER``.
   Returns:
       str: JSON string containing the extracted tags
   """
-  client = genai.Client(
-      vertexai=True,
-      project="ng-project-102",
-      location="global",
-  )
-
-  # Infer the MIME type of the file
-  mime_type, _ = mimetypes.guess_type(file_path)
+  if chunk_pages is None:
+      chunk_pages = app.config['CHUNK_PAGES']
+  if max_workers is None:
+      max_workers = app.config['CHUNK_WORKERS']
+  if compact is None:
+      compact = app.config['COMPACT_OUTPUT']
+  if text_layer is None:
+      text_layer = app.config['TEXT_LAYER']
+
+  with metrics.timed('read'):
+      file_bytes = read_document(source)
+
+  # Detect the MIME type from the file contents
+  mime_type = sniff_mime_type(file_bytes)
   if mime_type is None:
-      # Fallback for unknown types, or be more specific if needed
-      if file_path.lower().endswith('.pdf'):
-          mime_type = 'application/pdf'
+      raise ValueError("Could not determine the MIME type of the file.")
+
+  pages = try_page_count(file_bytes) if mime_type == 'application/pdf' else None
+  metrics.record_document(len(file_bytes), pages)
+
+  extractor = current_extractor()
+  text_layer = text_layer and mime_type == 'application/pdf' and textlayer.available()
+  # PDFs whose pages cannot be counted (no pypdf, or a file it cannot parse) go to the model whole
+  chunked = bool(chunk_pages) and (pages or 0) > chunk_pages
+
+  def compute():
+      # Runs only on a cache miss, so cached documents skip preflight too
+      model_bytes, page_map, report = prepare_document(file_bytes, mime_type)
+      # Page ranges of a chunked document are routed on the whole document
+      with routing.document(model_bytes, mime_type):
+          return extract(model_bytes, page_map, report)
+
+  def extract(model_bytes, page_map, report):
+      result_data = extract_text_layer(extractor, model_bytes, mime_type) if text_layer else None
+      if result_data is not None:
+          if page_map is not None:
+              preflight.remap_pages(result_data['line_details1'], page_map)
+          result_text = None
+      elif chunked:
+          result_data = extract_chunked(extractor, model_bytes, chunk_pages, max_workers, compact)
+          if page_map is not None:
+              preflight.remap_pages(result_data['line_details1'], page_map)
+          result_text = None
+      elif compact:
+          result_data = expand(json.loads(extractor.generate(model_bytes, mime_type, 'compact')))
+          result_text = None
       else:
-        raise ValueError("Could not determine the MIME type of the file.")
-
-  with open(file_path, "rb") as f:
-      file_bytes = f.read()
-
-  file_part = types.Part.from_bytes(
-      data=file_bytes,
-      mime_type=mime_type,
-  )
-
-  model = "gemini-3-pro-preview"
-  contents = [
-    types.Content(
-      role="user",
-      parts=[
-        types.Part.from_text(text="""Identify the tags and extract bounding box coordinates for both labels and values. 
-For each extracted field, provide normalized bounding box coordinates in the format [y_min, x_min, y_max, x_max] 
-where coordinates are normalized to a scale of 0-1000 (multiply actual coordinates by 1000 and divide by document dimensions).
-Extract bounding boxes for both the field label (if visible) and the field value. 
-If a label is not visible on the document, return empty bounding box [0, 0, 0, 0] for the label.
-Always provide bounding box coordinates for values when they exist."""),
-        file_part
-      ]
-    )
-  ]
-
-  generate_content_config = types.GenerateContentConfig(
-    temperature = 1,
-    top_p = 1,
-    max_output_tokens = 65535,
-    safety_settings = [types.SafetySetting(
-      category="HARM_CATEGORY_HATE_SPEECH",
-      threshold="OFF"
-    ),types.SafetySetting(
-      category="HARM_CATEGORY_DANGEROUS_CONTENT",
-      threshold="OFF"
-    ),types.SafetySetting(
-      category="HARM_CATEGORY_SEXUALLY_EXPLICIT",
-      threshold="OFF"
-    ),types.SafetySetting(
-      category="HARM_CATEGORY_HARASSMENT",
-      threshold="OFF"
-    )],
-    response_mime_type = "application/json",
-    response_schema = {
-        "type": "object",
-        "properties": {
-            "line_details1": {
-                "type": "array",
-                "description": "Contains a list of line item details. Include total and subtotal rows as well.",
-                "items": {
-                    "type": "object",
-                    "properties": {
-                        "claimId": {
-                            "type": "object",
-                            "properties": {
-                                "value": {"type": "string", "description": "Return an empty string."},
-                                "labelBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
-                                },
-                                "valueBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
-                                }
-                            }
-                        },
-                        "lineId": {
-                            "type": "object",
-                            "properties": {
-                                "value": {"type": "string", "description": "Return an empty string."},
-                                "labelBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
-                                },
-                                "valueBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
-                                }
-                            }
-                        },
-                        "serviceDateTime": {
-                            "type": "object",
-                            "properties": {
-                                "value": {"type": "string", "description": "Extract the 'Reference Date', 'service date', 'Registry Rate' or any Date mentioned in MM-DD-YYYY format. If these values are present within the line item, extract them from the line item. If these values are not present within the line item, extract them from the header section. If the current row is an 'ITEM' row, return the extracted 'service date'. If the current row is a 'SECTION TOTAL' or 'TOTAL' row, return an empty string for 'service date'."},
-                                "labelBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
-                                },
-                                "valueBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
-                                }
-                            }
-                        },
-                        "itemCode": {
-                            "type": "object",
-                            "properties": {
-                                "value": {"type": "string", "description": "Extract ONLY the value corresponding to 'Item Code' or 'Item ID', ONLY IF the KEY exists on the document. UNMISTAKABLY capture only if the tags or label matches. Preserve all original characters and spacing; Do not perform any auto-correction or modification of the extracted value. Other TAGS like 'Registry Number', 'slip no', 'Order No', or 'Document Number' or  column without any header should be IGNORED and SHOULD NOT be CAPTURED. UNMISTABLY, Ignore extraction If the headers 'Item Code' or 'Item ID' are not found, do not return any value as the item code."},
-                                "labelBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
-                                },
-                                "valueBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
-                                }
-                            }
-                        },
-                        "dataSource": {
-                            "type": "object",
-                            "properties": {
-                                "value": {"type": "string", "description": "Keep the field value as 'OCR'.", "enum": ["OCR"]},
-                                "labelBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
-                                },
-                                "valueBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
-                                }
-                            }
-                        },
-                        "lineTypeSectionTotalItem": {
-                            "type": "object",
-                            "properties": {
-                                "value": {"type": "string", "description": "Return as 'ITEM' if the row is ITEM. Return as 'SECTION TOTAL' if the row is section total or Total. Return an empty string if not applicable or unknown.", "enum": ["ITEM", "SECTION TOTAL", ""]},
-                                "labelBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
-                                },
-                                "valueBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
-                                }
-                            }
-                        },
-                        "sectionHeaderLineSectionType": {
-                            "type": "object",
-                            "properties": {
-                                "value": {"type": "string", "description": "For each line item, extract the DEPT code, DEFT code, Income center, Department, and medical department type (e.g., Laboratory, EYE Center, etc.). Prioritize extraction from the line item itself, and use the header section as a fallback source if these values are missing, as these codes and department types typically indicate the item's section or grouping. Ensure that the text extraction remains continuous and does not terminate upon encountering a special character within a word. You must also return the complete section header relevant to the line item; if the required data and the relevant header cannot be found, return an empty string."},
-                                "labelBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
-                                },
-                                "valueBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
-                                }
-                            }
-                        },
-                        "billsParticularsCostCenters": {
-                            "type": "object",
-                            "properties": {
-                                "value": {"type": "string", "description": "Extract the 'Item Description' or 'Description' or 'Items'. Return an empty string if not found."},
-                                "labelBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
-                                },
-                                "valueBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
-                                }
-                            }
-                        },
-                        "qty": {
-                            "type": "object",
-                            "properties": {
-                                "value": {"type": "string", "description": "Extract the 'QTY' or 'Quantity'. Return an empty string if not found."},
-                                "labelBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
-                                },
-                                "valueBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
-                                }
-                            }
-                        },
-                        "price": {
-                            "type": "object",
-                            "properties": {
-                                "value": {"type": "string", "description": "Extract the 'price'. Return an empty string if not found."},
-                                "labelBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
-                                },
-                                "valueBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
-                                }
-                            }
-                        },
-                        "discount": {
-                            "type": "object",
-                            "properties": {
-                                "value": {"type": "string", "description": "Extract the 'discount'. If it is '0.00' return '0.00' only. Return an empty string if not found (unless it's '0.00')."},
-                                "labelBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
-                                },
-                                "valueBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
-                                }
-                            }
-                        },
-                        "discountPercent": {
-                            "type": "object",
-                            "properties": {
-                                "value": {"type": "string", "description": "Extract the 'discount percent'. Return an empty string if not found."},
-                                "labelBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
-                                },
-                                "valueBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
-                                }
-                            }
-                        },
-                        "paidByPatientHospitalBill": {
-                            "type": "object",
-                            "properties": {
-                                "value": {"type": "string", "description": "Extract the 'paidByPatientHospitalBill'. Return an empty string if not found."},
-                                "labelBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
-                                },
-                                "valueBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
-                                }
-                            }
-                        },
-                        "philhealthHospBillPortionAmount": {
-                            "type": "object",
-                            "properties": {
-                                "value": {"type": "string", "description": "Extract the 'philhealthHospBillPortionAmount'. Return an empty string if not found."},
-                                "labelBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
-                                },
-                                "valueBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
-                                }
-                            }
-                        },
-                        "billsParticularsCostCenterAmount": {
-                            "type": "object",
-                            "properties": {
-                                "value": {"type": "string", "description": "Extract the 'Gross Amount' or 'Gross AMT' or 'Total Amount' or 'Amount' or 'Hospital'. Return an empty string if not found."},
-                                "labelBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
-                                },
-                                "valueBbox": {
-                                    "type": "array",
-                                    "items": {"type": "integer"},
-                                    "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
-                                }
-                            }
-                        }
-                    },
-                    "required": [
-                        "claimId",
-                        "lineId",
-                        "serviceDateTime",
-                        "itemCode",
-                        "dataSource",
-                        "lineTypeSectionTotalItem",
-                        "sectionHeaderLineSectionType",
-                        "billsParticularsCostCenters",
-                        "qty",
-                        "price",
-                        "discount",
-                        "discountPercent",
-                        "paidByPatientHospitalBill",
-                        "philhealthHospBillPortionAmount",
-                        "billsParticularsCostCenterAmount"
-                    ]
-                }
-            }
-        }
-    },
-    thinking_config=types.ThinkingConfig(
-      thinking_budget=-1,
-    ),
-  )
-
-  result_text = ""
-  for chunk in client.models.generate_content_stream(
-    model = model,
-    contents = contents,
-    config = generate_content_config,
-    ):
-    result_text += chunk.text
-  
-  return result_text
+          result_text = extractor.generate(model_bytes, mime_type)
+          # Only well-formed responses are worth caching
+          result_data = json.loads(result_text)
+      metrics.record_line_items(len(result_data.get('line_details1') or []))
+      if report is not None and model_bytes is not file_bytes:
+          result_data['preflight'] = report
+          result_text = None
+      return result_text if result_text is not None else json.dumps(result_data)
+
+  if compact:
+      variant = 'compact'
+  else:
+      variant = 'paged' if chunked else 'full'
+  fingerprint = extractor.fingerprint(variant)
+  if chunked:
+      fingerprint = f"{fingerprint}:chunk_pages={chunk_pages}"
+  fingerprint += preflight_fingerprint(mime_type)
+  if text_layer:
+      fingerprint = f"{fingerprint}:text_layer:{extractor.fingerprint('text')}"
+  key = make_key(file_bytes, fingerprint)
+  with metrics.timed('extract'):
+      return get_cache().get_or_compute(key, compute, bypass=not use_cache)
+
+def bbox_options(req):
+    """Reads the ``columnar``, ``coords=absolute`` and ``validation`` query parameters."""
+    return {
+        'columnar': bool(query_flag(req, 'columnar')),
+        'absolute': req.args.get('coords') == 'absolute',
+        'validation': bool(query_flag(req, 'validation')),
+    }
+
+def postprocess_result(result_data, source=None, columnar=False, absolute=False, validation=False):
+    """
+    Validates and cleans the bounding boxes of a parsed result (see ``bboxes.py``).
+
+    Args:
+        result_data (dict): Parsed result with ``line_details1``.
+        source (str | bytes | file): The document, needed for ``absolute``.
+        columnar (bool): Return one list per field instead of line item dicts.
+        absolute (bool): Return boxes in PDF points instead of the 0-1000 scale.
+        validation (bool): Add the ``validation`` report of the box issues found.
+    Returns:
+        dict: The cleaned result, or ``result_data`` unchanged when
+        post-processing is disabled or numpy is not installed.
+    """
+    enabled = app.config['BBOX_POSTPROCESS'] and bboxes.available()
+    if not (enabled or columnar or absolute or validation):
+        return result_data
+    sizes = None
+    if absolute:
+        file_bytes = read_document(source)
+        if sniff_mime_type(file_bytes) != 'application/pdf':
+            raise ValueError("Absolute coordinates are only available for PDFs.")
+        sizes = page_sizes(file_bytes)
+    with metrics.timed('postprocess'):
+        return bboxes.postprocess(
+            result_data,
+            iou_threshold=app.config['BBOX_IOU_THRESHOLD'] if app.config['BBOX_POSTPROCESS'] else 0,
+            page_sizes=sizes,
+            columnar=columnar,
+            report=validation,
+        )
+
+def clean_item(item):
+    """Clamps and repairs the boxes of a single streamed line item."""
+    if not (app.config['BBOX_POSTPROCESS'] and bboxes.available()):
+        return item
+    return bboxes.postprocess({'line_details1': [item]}, iou_threshold=0)['line_details1'][0]
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/upload', methods=['POST'])
-def upload_file():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
+def get_uploaded_file():
+    """
+    Validates the ``file`` field of the current upload request.
+
+    Returns:
+        tuple: ``(file, None)`` for a valid PDF upload, otherwise
+        ``(None, error_response)``.
+    """
+    # Parsing the multipart body spools the upload, so this is the receive time
+    with metrics.timed('receive'):
+        files = request.files
+    if 'file' not in files:
+        return None, (jsonify({'error': 'No file part'}), 400)
     
-    file = request.files['file']
+    file = files['file']
     
     if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
+        return None, (jsonify({'error': 'No selected file'}), 400)
     
-    if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+    if not (file and allowed_file(file.filename)):
+        return None, (jsonify({'error': 'Invalid file type. Only PDF files are allowed.'}), 400)
+
+    return file, None
+
+@app.route('/upload', methods=['POST'])
+def upload_file():
+    file, error = get_uploaded_file()
+    if error:
+        return error
+
+    try:
+        # Read straight from the request stream; nothing is written under a shared name
+        result_json = generate(
+            file.stream,
+            use_cache=not cache_bypassed(request),
+            chunk_pages=request.args.get('chunk_pages', type=int),
+            compact=query_flag(request, 'compact'),
+            text_layer=query_flag(request, 'text_layer'),
+        )
         
-        try:
-            result_json = generate(filepath)
-            # Clean up the uploaded file
-            os.remove(filepath)
-            
-            # Parse the JSON to validate it
+        # Parse the JSON to validate it
+        with metrics.timed('parse'):
             result_data = json.loads(result_json)
+        result_data = postprocess_result(result_data, file.stream, **bbox_options(request))
+        with metrics.timed('serialize'):
             return jsonify(result_data)
+    except QuotaExceeded as e:
+        return quota_exceeded_response(e)
+    except DeadlineExceeded as e:
+        return jsonify({'error': str(e)}), 504
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/upload/async', methods=['POST'])
+async def upload_async():
+    """
+    Async variant of ``/upload`` served by the shared ``AsyncEngine``.
+
+    Flask runs async views on the request's worker thread, so this does not
+    free the thread; the model call itself runs on the engine loop and is
+    admitted within the quota like every other engine call. Needs
+    ``flask[async]``. Page chunking is not applied on this path.
+    """
+    file, error = get_uploaded_file()
+    if error:
+        return error
+
+    file_bytes = file.read()
+    mime_type = sniff_mime_type(file_bytes)
+    if mime_type is None:
+        return jsonify({'error': 'Could not determine the MIME type of the file.'}), 400
+    compact = query_flag(request, 'compact')
+    if compact is None:
+        compact = app.config['COMPACT_OUTPUT']
+    variant = 'compact' if compact else 'full'
+
+    engine = get_engine()
+    cache = get_cache()
+    key = make_key(file_bytes, engine.fingerprint(variant) + preflight_fingerprint(mime_type))
+
+    async def compute():
+        # Preflight parses the PDF, so keep it off the event loop
+        model_bytes, _, report = await asyncio.to_thread(prepare_document, file_bytes, mime_type)
+        result_json = await engine.agenerate(model_bytes, mime_type, variant)
+        if compact:
+            result_json = expand_text(result_json)
+        result_data = json.loads(result_json)
+        if report is not None and model_bytes is not file_bytes:
+            result_data['preflight'] = report
+            result_json = json.dumps(result_data)
+        return result_json
+
+    try:
+        if cache_bypassed(request):
+            result_json = await compute()
+            cache.put(key, result_json)
+        else:
+            result_json = cache.get(key)
+            if result_json is None:
+                flight, leader = cache.begin(key)
+                if leader:
+                    try:
+                        result_json = await compute()
+                    except Exception as e:
+                        cache.finish(key, flight, error=e)
+                        raise
+                    cache.finish(key, flight, result_json)
+                else:
+                    # An identical upload is being extracted; share its result
+                    result_json = await asyncio.to_thread(cache.wait, flight)
+        result_data = json.loads(result_json)
+        return jsonify(postprocess_result(result_data, file_bytes, **bbox_options(request)))
+    except QuotaExceeded as e:
+        return quota_exceeded_response(e)
+    except DeadlineExceeded as e:
+        return jsonify({'error': str(e)}), 504
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def sse_event(event, data):
+    """Formats one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events):
+    return Response(events, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Stop reverse proxies from buffering the stream
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/upload/stream', methods=['POST'])
+def upload_stream():
+    """
+    Streams line items to the client as Server-Sent Events.
+
+    Emits an ``item`` event (``{"index": ..., "item": {...}}``) as soon as each
+    line item is complete in the model output, then a ``done`` event with the
+    item count, or an ``error`` event if extraction fails. A ``preflight``
+    event with the savings report comes first when pages were dropped.
+
+    Documents that need page chunking or the text-layer fast path cannot be
+    streamed as the model writes them; they are extracted with
+    ``generate()`` and their items sent once the result is complete, with
+    ``"streamed": false`` in the ``done`` event. Identical uploads in
+    flight at the same time share one model call.
+    """
+    file, error = get_uploaded_file()
+    if error:
+        return error
+
+    file_bytes = file.read()
+    mime_type = sniff_mime_type(file_bytes)
+    if mime_type is None:
+        return jsonify({'error': 'Could not determine the MIME type of the file.'}), 400
+    use_cache = not cache_bypassed(request)
+    compact = query_flag(request, 'compact')
+    if compact is None:
+        compact = app.config['COMPACT_OUTPUT']
+    variant = 'compact' if compact else 'full'
+    chunk_pages = request.args.get('chunk_pages', type=int)
+    if chunk_pages is None:
+        chunk_pages = app.config['CHUNK_PAGES']
+    text_layer = query_flag(request, 'text_layer')
+    if text_layer is None:
+        text_layer = app.config['TEXT_LAYER']
+    pdf = mime_type == 'application/pdf'
+    if (text_layer and pdf and textlayer.available()) or (chunk_pages and pdf and (try_page_count(file_bytes) or 0) > chunk_pages):
+        return sse_response(generated_events(file_bytes, use_cache, chunk_pages, compact, text_layer))
+    extractor = current_extractor()
+    cache = get_cache()
+    key = make_key(file_bytes, extractor.fingerprint(variant) + preflight_fingerprint(mime_type))
+
+    def send_items(items, **done):
+        for index, item in enumerate(items):
+            yield sse_event('item', {'index': index, 'item': clean_item(item)})
+        yield sse_event('done', {'count': len(items), **done})
+
+    def events():
+        flight, leader = None, True
+        try:
+            if use_cache:
+                cached = cache.get(key)
+                if cached is not None:
+                    yield from send_items(json.loads(cached).get('line_details1') or [], cached=True)
+                    return
+                flight, leader = cache.begin(key)
+                if not leader:
+                    # An identical upload is already streaming; send its result when it is done
+                    result = json.loads(cache.wait(flight))
+                    yield from send_items(result.get('line_details1') or [], cached=True)
+                    return
+
+            # Compact responses stream rows, which expand to full line items one by one
+            parser = LineItemParser('rows' if compact else 'line_details1')
+            index = 0
+            model_bytes, _, report = prepare_document(file_bytes, mime_type)
+            if report is not None and model_bytes is not file_bytes:
+                yield sse_event('preflight', report)
+            for chunk in extractor.stream(model_bytes, mime_type, variant):
+                for item in parser.feed(chunk):
+                    if compact:
+                        item = expand_row(item)
+                        item.pop('pageNumber', None)
+                    yield sse_event('item', {'index': index, 'item': clean_item(item)})
+                    index += 1
+            result_text = expand_text(parser.text) if compact else parser.text
+            result_data = json.loads(result_text)
+            if report is not None and model_bytes is not file_bytes:
+                # Same cached shape as generate(), so /upload can reuse it
+                result_data['preflight'] = report
+                result_text = json.dumps(result_data)
+            if flight is not None:
+                cache.finish(key, flight, result_text)
+                flight = None
+            else:
+                cache.put(key, result_text)
+            yield sse_event('done', {'count': parser.count, 'cached': False})
         except Exception as e:
-            # Clean up the uploaded file in case of error
-            if os.path.exists(filepath):
-                os.remove(filepath)
-            return jsonify({'error': str(e)}), 500
-    
-    return jsonify({'error': 'Invalid file type. Only PDF files are allowed.'}), 400
+            if flight is not None and leader:
+                cache.finish(key, flight, error=e)
+                flight = None
+            yield sse_event('error', {'error': str(e)})
+        finally:
+            # The client disconnected mid-stream; release anyone waiting on this upload
+            if flight is not None and leader:
+                cache.finish(key, flight, error=RuntimeError("Streaming extraction did not complete."))
+
+    return sse_response(events())
+
+def generated_events(file_bytes, use_cache, chunk_pages, compact, text_layer):
+    """Events for ``/upload/stream`` documents extracted through ``generate()``."""
+    try:
+        result = json.loads(generate(file_bytes, use_cache=use_cache, chunk_pages=chunk_pages,
+                                     compact=compact, text_layer=text_layer))
+        if result.get('preflight'):
+            yield sse_event('preflight', result['preflight'])
+        items = postprocess_result(result).get('line_details1') or []
+        for index, item in enumerate(items):
+            yield sse_event('item', {'index': index, 'item': item})
+        yield sse_event('done', {'count': len(items), 'streamed': False})
+    except Exception as e:
+        yield sse_event('error', {'error': str(e)})
+
+def run_job(document, options):
+    options = dict(options)
+    bbox = {key: options.pop(key, False) for key in ('columnar', 'absolute', 'validation')}
+    return postprocess_result(json.loads(generate(document, **options)), document, **bbox)
+
+def cleanup_job(document, options):
+    document.close()
+
+job_queue = JobQueue(
+    run_job,
+    workers=app.config['JOB_WORKERS'],
+    max_pending=app.config['JOB_QUEUE_SIZE'],
+    retention=app.config['JOB_RETENTION'],
+    cleanup=cleanup_job,
+)
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    file, error = get_uploaded_file()
+    if error:
+        return error
+
+    # Keep the upload in memory, spilling to an anonymous temporary file if it is large
+    document = spool(file.stream, app.config['UPLOAD_SPOOL_MAX_MEMORY'])
+
+    options = {
+        'use_cache': not cache_bypassed(request),
+        'chunk_pages': request.args.get('chunk_pages', type=int),
+        'compact': query_flag(request, 'compact'),
+        'text_layer': query_flag(request, 'text_layer'),
+        **bbox_options(request),
+    }
+    try:
+        job_id = job_queue.submit(document, options)
+    except QueueFull as e:
+        cleanup_job(document, options)
+        response = jsonify({'error': 'Too many pending jobs. Please retry later.'})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+
+    response = jsonify({'job_id': job_id, 'status': 'queued'})
+    response.headers['Location'] = f'/jobs/{job_id}'
+    return response, 202
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.after_request
+def count_request(response):
+    metrics.REQUESTS.inc(endpoint=request.endpoint or 'unknown', status=response.status_code)
+    return response
+
+def job_counts():
+    stats = job_queue.stats()
+    return dict(stats['jobs'], pending=stats['pending'])
+
+# Existing /stats counters, exposed as gauges read at scrape time
+metrics.register_stats('extract_cache', 'Result cache counters.', lambda: get_cache().stats())
+metrics.register_stats('extract_jobs', 'Background jobs by status.', job_counts, label='status')
+metrics.register_stats('extract_resilience', 'Model call attempts, retries and hedges.', lambda: get_extractor().stats())
+if app.config['ASYNC_ENGINE']:
+    metrics.register_stats('extract_engine', 'Async engine load and throttling.', lambda: get_engine().stats())
+
+@app.route('/stats')
+def stats():
+    result = {
+        'cache': get_cache().stats(),
+        'jobs': job_queue.stats(),
+        'extractor': get_extractor().stats(),
+    }
+    if app.config['ASYNC_ENGINE']:
+        result['engine'] = get_engine().stats()
+    return jsonify(result)
 
 if __name__ == "__main__":
     # Check if running as web server or CLI
-    import sys
-    if len(sys.argv) > 1:
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        # Batch CLI mode
+        parser = argparse.ArgumentParser(prog="app.py batch", description="Process many PDF files with Gemini, writing one JSONL record per file.")
+        parser.add_argument("inputs", nargs="*", help="Files, directories or glob patterns to process.")
+        parser.add_argument("--manifest", help="File listing one input path per line.")
+        parser.add_argument("-o", "--output", required=True, help="JSONL file results are appended to; also used to resume.")
+        parser.add_argument("-c", "--concurrency", type=int, default=4, help="Maximum number of documents processed at once.")
+        parser.add_argument("--no-resume", action="store_true", help="Process every input even if it already has a successful record.")
+        parser.add_argument("--no-cache", action="store_true", help="Skip the result cache and always call the model.")
+        parser.add_argument("--chunk-pages", type=int, help="Extract PDFs longer than this many pages in concurrent page ranges (0 disables).")
+        parser.add_argument("--compact", action="store_true", default=None, help="Use the compact model output format.")
+        parser.add_argument("--text-layer", action="store_true", default=None, help="Resolve boxes of born-digital PDFs from their text layer.")
+        parser.add_argument("--columnar", action="store_true", help="Write results with one list per field instead of line item dicts.")
+        parser.add_argument("--validation", action="store_true", help="Add a report of the bounding box issues found to each result.")
+        parser.add_argument("--async-engine", action="store_true", help="Route model calls through the rate-limited async engine (QUOTA_RPM, QUOTA_TPM, MAX_IN_FLIGHT).")
+        args = parser.parse_args(sys.argv[2:])
+        if not args.inputs and not args.manifest:
+            parser.error("no inputs given")
+        if args.async_engine:
+            app.config['ASYNC_ENGINE'] = True
+
+        def process(path):
+            result = json.loads(generate(path, use_cache=not args.no_cache, chunk_pages=args.chunk_pages, compact=args.compact,
+                                       text_layer=args.text_layer))
+            return postprocess_result(result, path, columnar=args.columnar, validation=args.validation)
+
+        paths = collect_inputs(args.inputs, manifest=args.manifest)
+        summary = run_batch(paths, process, args.output, concurrency=args.concurrency, resume=not args.no_resume)
+        print(json.dumps(summary), file=sys.stderr)
+        sys.exit(1 if summary['error'] else 0)
+    elif len(sys.argv) > 1:
         # CLI mode
         parser = argparse.ArgumentParser(description="Process an image or PDF file with Gemini.")
         parser.add_argument("file_path", help="The path to the image or PDF file.")
+        parser.add_argument("--no-cache", action="store_true", help="Skip the result cache and always call the model.")
+        parser.add_argument("--chunk-pages", type=int, help="Extract PDFs longer than this many pages in concurrent page ranges (0 disables).")
+        parser.add_argument("--workers", type=int, help="Maximum concurrent model calls when chunking.")
+        parser.add_argument("--compact", action="store_true", default=None, help="Use the compact model output format.")
+        parser.add_argument("--text-layer", action="store_true", default=None, help="Resolve boxes of born-digital PDFs from their text layer.")
+        parser.add_argument("--columnar", action="store_true", help="Print one list per field instead of line item dicts.")
+        parser.add_argument("--absolute", action="store_true", help="Return bounding boxes in PDF points instead of the 0-1000 scale.")
+        parser.add_argument("--validation", action="store_true", help="Add a report of the bounding box issues found.")
         args = parser.parse_args()
-        result = generate(args.file_path)
-        print(result)
+        with metrics.trace() as timings:
+            result = generate(
+                args.file_path,
+                use_cache=not args.no_cache,
+                chunk_pages=args.chunk_pages,
+                max_workers=args.workers,
+                compact=args.compact,
+                text_layer=args.text_layer,
+            )
+            result = postprocess_result(json.loads(result), args.file_path, columnar=args.columnar,
+                                        absolute=args.absolute, validation=args.validation)
+        print(json.dumps(result))
+        # Timing summary goes to stderr so stdout stays valid JSON
+        print(json.dumps({'timings': timings}), file=sys.stderr)
     else:
         # Web server mode
-        app.run(host='0.0.0.0', port=8000, debug=True)
+        app.run(host='0.0.0.0', port=8000, debug=os.environ.get('FLASK_DEBUG') == '1', threaded=True)
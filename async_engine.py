@@ -0,0 +1,326 @@
+"""
+asyncio extraction engine with quota-aware rate limiting.
+
+Throughput is bounded by the Vertex AI quota rather than CPU. The engine runs
+one event loop on a background thread that owns the async model client, a
+token-bucket limiter for requests and estimated tokens per minute, and a
+semaphore capping calls in flight. Sync callers (Flask threads, the batch
+runner, chunked extraction) use ``generate()`` or ``stream()``; coroutines
+running on any other event loop use ``await engine.agenerate()``.
+
+The engine exposes the same ``generate()``, ``stream()`` and
+``fingerprint()`` interface as an ``Extractor``, so it can be dropped in
+wherever an extractor is expected.
+
+Retries and hedges made by a wrapped ``ResilientExtractor`` are admitted
+through the limiter as well, and 429 responses are never retried locally:
+they pause admissions for every caller instead.
+"""
+import asyncio
+import contextvars
+import os
+import queue
+import threading
+import time
+
+from documents import page_count
+from extractor import PROMPT, error_status, get_extractor
+from metrics import record_stage
+from resilience import quota_gate
+
+# Gemini bills each PDF page as a fixed number of input tokens
+TOKENS_PER_PAGE = 258
+
+
+class QuotaExceeded(Exception):
+    """Raised when the model rejects a call because the quota is exhausted."""
+
+    def __init__(self, retry_after, message="Model quota exceeded"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at ``per_minute`` tokens per minute.
+
+    A rate of 0 disables the bucket. Must only be used from one event loop.
+    """
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        """
+        Waits until ``amount`` tokens are available and takes them.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        if self.rate <= 0:
+            return 0.0
+        # A single call larger than the bucket could never be admitted otherwise
+        amount = min(amount, self.capacity)
+        started = time.monotonic()
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return time.monotonic() - started
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def drain(self, seconds):
+        """Empties the bucket so no tokens are available for ``seconds``."""
+        if self.rate <= 0:
+            return
+        self._refill()
+        self.tokens = -seconds * self.rate
+
+
+class RateLimiter:
+    """
+    Limits requests per minute and estimated tokens per minute together.
+
+    Args:
+        rpm (int): Requests per minute; 0 for no limit.
+        tpm (int): Tokens per minute; 0 for no limit.
+    """
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    async def acquire(self, tokens):
+        """Waits for one request slot and ``tokens`` tokens; returns the wait in seconds."""
+        waited = await self.requests.acquire(1)
+        waited += await self.tokens.acquire(tokens)
+        return waited
+
+    def backoff(self, seconds):
+        """Pauses admissions after the model reported the quota as exhausted."""
+        self.requests.drain(seconds)
+        self.tokens.drain(seconds)
+
+
+def estimate_tokens(file_bytes, mime_type, expected_output_tokens):
+    """
+    Estimates the quota cost of one extraction call.
+
+    Args:
+        file_bytes (bytes): The raw document contents.
+        mime_type (str): The MIME type of the document.
+        expected_output_tokens (int): Output tokens to budget for.
+    Returns:
+        int: Estimated input plus output tokens.
+    """
+    pages = 1
+    if mime_type == 'application/pdf':
+        try:
+            pages = page_count(file_bytes)
+        except Exception:
+            # Without pypdf (or for a damaged file) fall back to a size heuristic
+            pages = max(1, len(file_bytes) // (100 * 1024))
+    prompt_tokens = len(PROMPT) // 4
+    return pages * TOKENS_PER_PAGE + prompt_tokens + expected_output_tokens
+
+
+class AsyncEngine:
+    """
+    Runs extractions on a dedicated event loop within the quota.
+
+    Args:
+        extractor (Extractor): Backend providing ``astream()``.
+        rpm (int): Requests per minute allowed by the quota; 0 for no limit.
+        tpm (int): Tokens per minute allowed by the quota; 0 for no limit.
+        max_in_flight (int): Maximum concurrent model calls.
+        expected_output_tokens (int): Output tokens budgeted per call.
+        quota_backoff (float): Seconds to pause admissions after a 429.
+    """
+
+    def __init__(self, extractor, rpm=60, tpm=0, max_in_flight=16,
+                 expected_output_tokens=8192, quota_backoff=10.0):
+        self.extractor = extractor
+        self.model = extractor.model
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_in_flight = max_in_flight
+        self.expected_output_tokens = expected_output_tokens
+        self.quota_backoff = quota_backoff
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.counters = {
+            'requests': 0,
+            'in_flight': 0,
+            'waiting': 0,
+            'throttled_s': 0.0,
+            'quota_errors': 0,
+        }
+
+    def fingerprint(self, variant="full"):
+        return self.extractor.fingerprint(variant)
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return self._loop
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                # Limiter primitives must be created on the loop that uses them
+                self._limiter = RateLimiter(self.rpm, self.tpm)
+                self._semaphore = asyncio.Semaphore(self.max_in_flight)
+                ready.set()
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name="async-engine", daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+            return loop
+
+    async def _extract(self, call, tokens, context):
+        # The task runs in its own context on the engine loop; adopt the caller's
+        # context variables (trace, routing document, deadline scope)
+        for var, value in context.items():
+            var.set(value)
+        return await self._admit(call, tokens)
+
+    async def _admit(self, call, tokens):
+        admitted = False
+        self.counters['waiting'] += 1
+        try:
+            async with self._semaphore:
+                waited = await self._limiter.acquire(tokens)
+                self.counters['throttled_s'] += waited
+                record_stage('quota_wait', waited)
+                self.counters['waiting'] -= 1
+                admitted = True
+                self.counters['in_flight'] += 1
+                self.counters['requests'] += 1
+                try:
+                    with quota_gate(self._attempt_gate(tokens)):
+                        return await call()
+                except Exception as e:
+                    if error_status(e) == 429:
+                        self.counters['quota_errors'] += 1
+                        self._limiter.backoff(self.quota_backoff)
+                        raise QuotaExceeded(self.quota_backoff, str(e)) from e
+                    raise
+                finally:
+                    self.counters['in_flight'] -= 1
+        finally:
+            if not admitted:
+                self.counters['waiting'] -= 1
+
+    def _attempt_gate(self, tokens):
+        """
+        Admits retries and hedges of an already admitted call.
+
+        The first attempt was paid for when the call was admitted; every
+        further attempt takes its own share of the quota.
+        """
+        first = True
+
+        async def admit():
+            nonlocal first
+            if first:
+                first = False
+                return
+            waited = await self._limiter.acquire(tokens)
+            self.counters['throttled_s'] += waited
+            record_stage('quota_wait', waited)
+        return admit
+
+    def _schedule(self, file_bytes, mime_type, call):
+        loop = self._ensure_started()
+        # Estimated on the calling thread so PDF parsing never blocks the engine loop
+        tokens = estimate_tokens(file_bytes, mime_type, self.expected_output_tokens)
+        coro = self._extract(call, tokens, contextvars.copy_context())
+        return asyncio.run_coroutine_threadsafe(coro, loop)
+
+    def submit(self, file_bytes, mime_type, variant="full"):
+        """
+        Schedules an extraction on the engine loop.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the JSON response text.
+        """
+        return self._schedule(file_bytes, mime_type, lambda: self.extractor.agenerate(file_bytes, mime_type, variant))
+
+    def stream(self, file_bytes, mime_type, variant="full"):
+        """
+        Blocking stream for threads, admitted like ``generate()``.
+
+        The call holds its quota and in-flight slot until the stream ends.
+        Closing the generator early cancels it.
+        """
+        chunks = queue.Queue()
+
+        async def forward():
+            async for chunk in self.extractor.astream(file_bytes, mime_type, variant):
+                chunks.put(chunk)
+
+        future = self._schedule(file_bytes, mime_type, forward)
+        future.add_done_callback(lambda _: chunks.put(None))
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                yield chunk
+            future.result()
+        finally:
+            future.cancel()
+
+    def generate(self, file_bytes, mime_type, variant="full"):
+        """Blocking extraction for threads; same contract as ``Extractor.generate()``."""
+        return self.submit(file_bytes, mime_type, variant).result()
+
+    async def agenerate(self, file_bytes, mime_type, variant="full"):
+        """Awaitable extraction usable from any event loop."""
+        return await asyncio.wrap_future(self.submit(file_bytes, mime_type, variant))
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['throttled_s'] = round(stats['throttled_s'], 3)
+        stats.update(rpm=self.rpm, tpm=self.tpm, max_in_flight=self.max_in_flight)
+        return stats
+
+
+def create_engine(extractor=None):
+    """Builds an ``AsyncEngine`` around ``extractor`` using environment settings."""
+    return AsyncEngine(
+        extractor or get_extractor(),
+        rpm=int(os.environ.get('QUOTA_RPM', 60)),
+        tpm=int(os.environ.get('QUOTA_TPM', 0)),
+        max_in_flight=int(os.environ.get('MAX_IN_FLIGHT', 16)),
+        expected_output_tokens=int(os.environ.get('EXPECTED_OUTPUT_TOKENS', 8192)),
+        quota_backoff=float(os.environ.get('QUOTA_BACKOFF', 10)),
+    )
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Returns the process-wide engine, creating it on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine()
+    return _engine
@@ -0,0 +1,159 @@
+"""
+Batch extraction over many documents.
+
+Inputs are expanded from directories, glob patterns and manifest files, then
+processed concurrently. Each finished document is appended to a JSONL file
+as soon as it completes, and that file doubles as the checkpoint: re-running
+the same command skips documents that already have a successful record.
+"""
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+
+
+def collect_inputs(sources, manifest=None, extensions=('.pdf',)):
+    """
+    Expands directories, glob patterns and manifest files into file paths.
+
+    Args:
+        sources (list): Files, directories (searched recursively) or glob patterns.
+        manifest (str): Optional file listing one path per line; blank lines
+            and lines starting with ``#`` are ignored.
+        extensions (tuple): File extensions picked up when walking directories.
+    Returns:
+        list: Unique file paths in the order they were found.
+    """
+    sources = list(sources)
+    if manifest:
+        with open(manifest, "r", encoding="utf-8") as f:
+            sources.extend(
+                line.strip() for line in f
+                if line.strip() and not line.lstrip().startswith('#')
+            )
+
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                paths.extend(
+                    os.path.join(root, name) for name in sorted(files)
+                    if name.lower().endswith(extensions)
+                )
+        elif glob.has_magic(source):
+            paths.extend(sorted(p for p in glob.glob(source, recursive=True) if os.path.isfile(p)))
+        else:
+            paths.append(source)
+    return list(dict.fromkeys(paths))
+
+
+def load_completed(output_path):
+    """
+    Reads the paths that already have a successful record in a JSONL output.
+
+    A partially written last line (e.g. after a crash) is ignored.
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('status') == 'ok':
+                completed.add(record['path'])
+    return completed
+
+
+def _end_partial_line(output_path):
+    """Terminates a partially written last line so the next record starts on its own line."""
+    try:
+        with open(output_path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+    except FileNotFoundError:
+        pass
+
+
+def _process_one(process, path):
+    started = time.perf_counter()
+    with metrics.trace() as timings:
+        try:
+            outcome = {'status': 'ok', 'result': process(path)}
+        except Exception as e:
+            outcome = {'status': 'error', 'error': f"{type(e).__name__}: {e}"}
+    record = {
+        'path': path,
+        'status': outcome.pop('status'),
+        'elapsed_s': round(time.perf_counter() - started, 3),
+        'timings': timings,
+    }
+    record.update(outcome)
+    return record
+
+
+def run_batch(paths, process, output_path, concurrency=4, resume=True, log=sys.stderr):
+    """
+    Processes documents concurrently, streaming one JSONL record per document.
+
+    Args:
+        paths (list): Documents to process.
+        process (callable): Takes a path and returns a JSON-serialisable result.
+        output_path (str): JSONL file the records are appended to.
+        concurrency (int): Maximum number of documents in flight.
+        resume (bool): Skip documents with a successful record in ``output_path``.
+        log (file): Where progress is reported; None to stay quiet.
+    Returns:
+        dict: Counts of ``ok``, ``error`` and ``skipped`` documents.
+    """
+    summary = {'ok': 0, 'error': 0, 'skipped': 0}
+    if resume:
+        completed = load_completed(output_path)
+        pending = [path for path in paths if path not in completed]
+        summary['skipped'] = len(paths) - len(pending)
+    else:
+        pending = list(paths)
+
+    total = len(pending)
+    write_lock = threading.Lock()
+    # A crash mid-write leaves a partial record; appending to it would corrupt the next one
+    _end_partial_line(output_path)
+    with open(output_path, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        def write(record):
+            with write_lock:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                summary[record['status']] += 1
+                if log is not None:
+                    done = summary['ok'] + summary['error']
+                    print(f"[{done}/{total}] {record['status']} {record['path']} ({record['elapsed_s']}s)", file=log)
+
+        # Only keep a bounded number of futures around so huge backfills do not
+        # queue every document up front
+        queue = iter(pending)
+        in_flight = set()
+        while True:
+            for path in queue:
+                in_flight.add(executor.submit(_process_one, process, path))
+                if len(in_flight) >= concurrency * 2:
+                    break
+            if not in_flight:
+                break
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                write(future.result())
+    return summary
@@ -0,0 +1,329 @@
+"""
+Bounding box post-processing and validation.
+
+All label and value boxes of a response are loaded into one
+``(items, fields, 2, 4)`` array so they can be checked in bulk instead of
+field by field:
+
+* coordinates are clamped to the 0-1000 scale,
+* inverted boxes (min greater than max) are flagged and their corners swapped,
+* zero-area boxes are flagged (``[0, 0, 0, 0]`` means "not present" and is
+  left alone),
+* optionally, line items whose row boxes (description, quantity, price and
+  amount) overlap an earlier item on the same page above an IoU threshold are
+  dropped as duplicates. This needs a page index per item and is off by
+  default,
+* optionally, boxes are converted to absolute page coordinates in PDF points.
+
+Results can also be returned in a columnar layout (one list per field) so
+clients handling thousands of rows do not walk nested dicts per field.
+
+``numpy`` is only needed for this stage; ``available()`` reports whether it
+is installed.
+"""
+from extractor import LINE_ITEM_FIELDS
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+SCALE = 1000
+BOX_KINDS = ("labelBbox", "valueBbox")
+# Deduplication is opt-in; 0.9 is a reasonable threshold when enabling it
+DEFAULT_IOU_THRESHOLD = 0.0
+
+# Fields printed on the line item's own row. Others, like the section header
+# and service date, are often taken from a header shared by adjacent rows.
+ROW_FIELDS = ("billsParticularsCostCenters", "qty", "price", "billsParticularsCostCenterAmount")
+
+# Rows compared against each other at once when looking for duplicates
+_IOU_BLOCK = 1024
+
+
+def available():
+    """Whether ``numpy`` is installed."""
+    return np is not None
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("numpy is required for bounding box post-processing. Install it with `pip install numpy`.")
+
+
+def _box(value):
+    # Anything that is not four numbers is treated as missing and reported
+    if isinstance(value, list) and len(value) == 4 and all(
+            isinstance(v, (int, float)) and not isinstance(v, bool) for v in value):
+        return value, False
+    return [0, 0, 0, 0], value is not None
+
+
+def load_boxes(items, fields=LINE_ITEM_FIELDS):
+    """
+    Loads every box of a response into one array.
+
+    Args:
+        items (list): Line items in the full response shape.
+        fields (list): Field names, in the order of the second axis.
+    Returns:
+        tuple: ``(boxes, malformed)``. ``boxes`` is a float array of shape
+        ``(len(items), len(fields), 2, 4)`` with label boxes at index 0 and
+        value boxes at index 1; ``malformed`` flags entries that were not four
+        numbers and were loaded as zeros.
+    """
+    _require_numpy()
+    shape = (len(items), len(fields), 2)
+    flat = []
+    for item in items:
+        for field in fields:
+            entry = item.get(field)
+            if not isinstance(entry, dict):
+                entry = {}
+            flat.append(entry.get(BOX_KINDS[0]))
+            flat.append(entry.get(BOX_KINDS[1]))
+    # Well-formed responses convert in one call; only fall back to checking
+    # box by box when something is missing or has the wrong shape
+    try:
+        boxes = np.array(flat, dtype=np.float64)
+    except (TypeError, ValueError):
+        boxes = None
+    if boxes is not None and boxes.shape == (len(flat), 4):
+        return boxes.reshape(shape + (4,)), np.zeros(shape, dtype=bool)
+
+    checked = [_box(value) for value in flat]
+    boxes = np.array([box for box, _ in checked], dtype=np.float64).reshape(shape + (4,))
+    malformed = np.array([bad for _, bad in checked], dtype=bool).reshape(shape)
+    return boxes, malformed
+
+
+def validate(boxes):
+    """
+    Clamps boxes to the 0-1000 scale and repairs inverted ones.
+
+    Args:
+        boxes (numpy.ndarray): Array from ``load_boxes()``; modified in place.
+    Returns:
+        dict: Boolean masks over the box axes: ``present`` (not all zeros),
+        ``clamped``, ``inverted`` and ``zero_area``.
+    """
+    present = np.any(boxes != 0, axis=-1)
+    out_of_range = np.any((boxes < 0) | (boxes > SCALE), axis=-1)
+    np.clip(boxes, 0, SCALE, out=boxes)
+
+    y_min, x_min, y_max, x_max = (boxes[..., i] for i in range(4))
+    inverted = present & ((y_min > y_max) | (x_min > x_max))
+    # Swap the corners so [y_min, x_min, y_max, x_max] holds again
+    lo_y, hi_y = np.minimum(y_min, y_max), np.maximum(y_min, y_max)
+    lo_x, hi_x = np.minimum(x_min, x_max), np.maximum(x_min, x_max)
+    boxes[...] = np.stack([lo_y, lo_x, hi_y, hi_x], axis=-1)
+
+    zero_area = present & ((hi_y == lo_y) | (hi_x == lo_x))
+    return {
+        'present': present,
+        'clamped': present & out_of_range,
+        'inverted': inverted,
+        'zero_area': zero_area,
+    }
+
+
+def item_pages(items):
+    """0-based page index of each item, from ``pageIndex`` or ``pageNumber``; -1 when unknown."""
+    pages = []
+    for item in items:
+        page = item.get('pageIndex')
+        if not isinstance(page, int):
+            number = item.get('pageNumber')
+            page = number - 1 if isinstance(number, int) and number > 0 else -1
+        pages.append(page)
+    return np.array(pages, dtype=np.int64)
+
+
+def envelopes(boxes, present, columns=None):
+    """
+    Returns the box enclosing the value boxes of each item.
+
+    Args:
+        boxes (numpy.ndarray): Array from ``load_boxes()``.
+        present (numpy.ndarray): The ``present`` mask from ``validate()``.
+        columns (list): Field indices to enclose; all fields when None.
+    Returns:
+        tuple: ``(envelopes, has_box)``: an ``(items, 4)`` array and a mask of
+        items that have at least one value box.
+    """
+    values = boxes[:, :, 1, :]
+    mask = present[:, :, 1]
+    if columns is not None:
+        values = values[:, columns]
+        mask = mask[:, columns]
+    has_box = mask.any(axis=1)
+    low = np.where(mask[..., None], values, np.inf).min(axis=1)
+    high = np.where(mask[..., None], values, -np.inf).max(axis=1)
+    env = np.concatenate([low[:, :2], high[:, 2:]], axis=1)
+    env[~has_box] = 0
+    return env, has_box
+
+
+def duplicate_items(boxes, present, pages, iou_threshold=DEFAULT_IOU_THRESHOLD, columns=None):
+    """
+    Flags items whose row boxes overlap an earlier item on the same page.
+
+    Items are compared by the envelope of the value boxes in ``columns``. An
+    item is a duplicate when its IoU with any earlier item on the same page
+    reaches ``iou_threshold``; the first occurrence is kept. Items without a
+    known page (``pages`` is -1) are never flagged, since boxes of different
+    pages share one coordinate space.
+
+    Returns:
+        numpy.ndarray: Boolean mask over items.
+    """
+    count = boxes.shape[0]
+    duplicate = np.zeros(count, dtype=bool)
+    if count < 2 or not iou_threshold:
+        return duplicate
+    env, has_box = envelopes(boxes, present, columns)
+    has_box &= pages >= 0
+    # Only items on the same page can be duplicates; a stable sort keeps
+    # document order within each page
+    order = np.argsort(pages, kind='stable')
+    order = order[has_box[order]]
+    groups = np.split(order, np.flatnonzero(np.diff(pages[order])) + 1)
+    for group in groups:
+        # Compare in blocks so pages with thousands of rows do not need a full n x n matrix at once
+        for start in range(0, len(group), _IOU_BLOCK):
+            stop = min(start + _IOU_BLOCK, len(group))
+            iou = _iou(env[group[start:stop]], env[group[:stop]])
+            earlier = np.arange(stop)[None, :] < np.arange(start, stop)[:, None]
+            duplicate[group[start:stop]] = ((iou >= iou_threshold) & earlier).any(axis=1)
+    return duplicate
+
+
+def _iou(a, b):
+    """IoU matrix between two sets of ``[y_min, x_min, y_max, x_max]`` boxes."""
+    a, b = a[:, None, :], b[None, :, :]
+    inter_h = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    inter_w = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = inter_h * inter_w
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union = area_a + area_b - inter
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union > 0, inter / union, 0.0)
+
+
+def to_absolute(boxes, pages, page_sizes):
+    """
+    Converts 0-1000 boxes to absolute page coordinates.
+
+    Args:
+        boxes (numpy.ndarray): Array from ``load_boxes()``.
+        pages (numpy.ndarray): 0-based page index of each item.
+        page_sizes (list): ``(width, height)`` of each page, e.g. from
+            ``documents.page_sizes()``.
+    Returns:
+        numpy.ndarray: Boxes in the units of ``page_sizes``.
+    """
+    sizes = np.array(page_sizes, dtype=np.float64).reshape(-1, 2)
+    index = np.clip(pages, 0, len(sizes) - 1)
+    width, height = sizes[index, 0], sizes[index, 1]
+    scale = np.stack([height, width, height, width], axis=-1) / SCALE
+    return boxes * scale[:, None, None, :]
+
+
+def _report(flags, malformed, duplicate, fields):
+    report = {
+        'boxes': int(flags['present'].sum()),
+        'clamped': int(flags['clamped'].sum()),
+        'inverted': int(flags['inverted'].sum()),
+        'zeroArea': int(flags['zero_area'].sum()),
+        'malformed': int(malformed.sum()),
+        'duplicates': np.flatnonzero(duplicate).tolist(),
+        'flagged': [],
+    }
+    for issue, mask in (('inverted', flags['inverted']), ('zeroArea', flags['zero_area']), ('malformed', malformed)):
+        for item, field, kind in zip(*np.nonzero(mask)):
+            report['flagged'].append({
+                'item': int(item),
+                'field': fields[field],
+                'box': BOX_KINDS[kind],
+                'issue': issue,
+            })
+    report['flagged'].sort(key=lambda flag: flag['item'])
+    return report
+
+
+def _columns(items, boxes, keep, fields):
+    kept = [item for item, k in zip(items, keep) if k]
+    box_lists = boxes[keep].tolist()
+    columns = {}
+    for f, field in enumerate(fields):
+        columns[field] = {
+            'value': [(item.get(field) or {}).get('value', '') for item in kept],
+            'labelBbox': [row[f][0] for row in box_lists],
+            'valueBbox': [row[f][1] for row in box_lists],
+        }
+    result = {'format': 'columnar', 'count': len(kept), 'fields': list(fields), 'columns': columns}
+    for extra in ('pageIndex', 'pageNumber'):
+        if any(extra in item for item in kept):
+            result[extra] = [item.get(extra) for item in kept]
+    return result
+
+
+def postprocess(result, iou_threshold=DEFAULT_IOU_THRESHOLD, page_sizes=None, columnar=False,
+                fields=LINE_ITEM_FIELDS, report=False):
+    """
+    Validates and cleans the boxes of a parsed response.
+
+    Args:
+        result (dict): Parsed response with ``line_details1``.
+        iou_threshold (float): Overlap at which an item counts as a duplicate
+            of an earlier one; 0 disables deduplication.
+        page_sizes (list): ``(width, height)`` per page to return boxes in
+            absolute coordinates; None keeps the 0-1000 scale.
+        columnar (bool): Return one list per field instead of line item dicts.
+        fields (list): Field names carrying boxes.
+        report (bool): Add a ``validation`` report of the issues found.
+    Returns:
+        dict: ``{"line_details1": [...]}`` or the columnar layout, plus
+        ``validation`` when ``report`` is set. Items are not modified in
+        place.
+    """
+    _require_numpy()
+    items = result.get('line_details1') or []
+    boxes, malformed = load_boxes(items, fields)
+    flags = validate(boxes)
+    pages = item_pages(items)
+    columns = [fields.index(field) for field in ROW_FIELDS if field in fields]
+    duplicate = duplicate_items(boxes, flags['present'], pages, iou_threshold, columns or None)
+    if page_sizes is not None:
+        boxes = np.round(to_absolute(boxes, pages, page_sizes), 2)
+    else:
+        boxes = np.rint(boxes).astype(np.int64)
+
+    keep = ~duplicate
+    if columnar:
+        output = _columns(items, boxes, keep, fields)
+    else:
+        box_lists = boxes.tolist()
+        cleaned = []
+        for i, item in enumerate(items):
+            if not keep[i]:
+                continue
+            item = dict(item)
+            for f, field in enumerate(fields):
+                entry = item.get(field)
+                entry = dict(entry) if isinstance(entry, dict) else {'value': ''}
+                entry['labelBbox'], entry['valueBbox'] = box_lists[i][f]
+                item[field] = entry
+            cleaned.append(item)
+        output = {'line_details1': cleaned}
+    # Keep other top-level keys, e.g. the preflight report
+    for key, value in result.items():
+        if key != 'line_details1':
+            output.setdefault(key, value)
+    if page_sizes is not None:
+        output['coordinates'] = 'points'
+        output['pageSizes'] = [list(size) for size in page_sizes]
+    if report:
+        output['validation'] = _report(flags, malformed, duplicate, fields)
+    return output
@@ -0,0 +1,99 @@
+"""
+Compares the full response schema against the compact row format.
+
+Runs every document through both variants against the real model and reports
+output tokens, thinking tokens, time to first chunk and wall time. Compact
+responses are expanded exactly as the server does, so the line item counts
+of both variants can be compared too.
+
+Usage:
+    python benchmarks/compact_schema.py bill1.pdf bill2.pdf --repeat 3 -o compact.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compact import expand  # noqa: E402
+from extractor import create_backend, load_config  # noqa: E402
+
+
+def run_once(extractor, file_bytes, variant):
+    """Runs one extraction and returns its timing and token usage."""
+    started = time.perf_counter()
+    first_chunk = None
+    usage = None
+    parts = []
+    for chunk in extractor.client.models.generate_content_stream(
+        model=extractor.model,
+        contents=extractor.build_contents(file_bytes, "application/pdf", variant),
+        config=extractor.configs[variant],
+    ):
+        if first_chunk is None:
+            first_chunk = time.perf_counter() - started
+        if chunk.text:
+            parts.append(chunk.text)
+        if chunk.usage_metadata is not None:
+            usage = chunk.usage_metadata
+    wall = time.perf_counter() - started
+
+    result = json.loads("".join(parts))
+    if variant == "compact":
+        result = expand(result)
+    return {
+        "wall_s": round(wall, 3),
+        "first_chunk_s": round(first_chunk or wall, 3),
+        "output_tokens": getattr(usage, "candidates_token_count", None),
+        "thinking_tokens": getattr(usage, "thoughts_token_count", None),
+        "input_tokens": getattr(usage, "prompt_token_count", None),
+        "line_items": len(result.get("line_details1") or []),
+    }
+
+
+def summarize(runs):
+    summary = {}
+    for key in ("wall_s", "first_chunk_s", "output_tokens", "thinking_tokens", "input_tokens", "line_items"):
+        values = [run[key] for run in runs if run[key] is not None]
+        if values:
+            summary[key] = round(statistics.median(values), 3)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the compact output format against the full schema.")
+    parser.add_argument("files", nargs="+", help="PDF files to extract.")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per document and variant.")
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    # Use the bare backend so retries and hedging do not skew the timings
+    extractor = create_backend(dict(load_config(), backend='gemini'))
+    report = {"model": extractor.model, "documents": {}}
+    for path in args.files:
+        with open(path, "rb") as f:
+            file_bytes = f.read()
+        entry = {}
+        for variant in ("full", "compact"):
+            runs = [run_once(extractor, file_bytes, variant) for _ in range(args.repeat)]
+            entry[variant] = summarize(runs)
+        full, compact = entry["full"], entry["compact"]
+        if full.get("output_tokens") and compact.get("output_tokens"):
+            entry["output_token_ratio"] = round(compact["output_tokens"] / full["output_tokens"], 3)
+        entry["wall_time_ratio"] = round(compact["wall_s"] / full["wall_s"], 3)
+        report["documents"][path] = entry
+        print(f"{path}: {json.dumps(entry)}", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
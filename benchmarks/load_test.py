@@ -0,0 +1,340 @@
+"""
+Offline load test for the request path, driven by the replay backend.
+
+Fires a fixed number of extractions at a target with the given concurrency
+and reports throughput, p50/p95/p99 latency, peak RSS and server-side CPU
+per request. No network access or Vertex quota is needed: the model is
+replaced by ``ReplayExtractor`` playing back a recording
+(``benchmarks/recordings/`` by default) with configurable latency and
+injected errors.
+
+Targets:
+    app  Flask app in this process, called through its test client.
+    url  A running server (start it with EXTRACTOR_BACKEND=replay); CPU and
+         RSS are read from its /metrics endpoint.
+    cli  ``python app.py <file>`` as one subprocess per extraction.
+
+Results are written as JSON. With ``--baseline`` the run is compared against
+an earlier result and the exit status is 1 if latency, CPU or throughput
+regressed by more than ``--max-regression``, which makes it usable as a CI gate.
+
+Usage:
+    python benchmarks/load_test.py app -n 200 -c 16 --ttft 0.5 --chunk-delay 0.01 -o load.json
+    python benchmarks/load_test.py cli -n 20 -c 4 --baseline load-cli.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_RECORDINGS = os.path.join(ROOT, "benchmarks", "recordings")
+
+# Lower is better for these; throughput is checked separately
+REGRESSION_KEYS = ("p50_s", "p95_s", "p99_s", "cpu_s_per_request")
+
+
+def blank_pdf():
+    """Returns a valid one-page PDF; the replay backend never looks at its content."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>",
+    ]
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return out
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values``."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def replay_env(args):
+    """Environment variables configuring the replay backend for a target."""
+    env = {
+        'EXTRACTOR_BACKEND': 'replay',
+        'REPLAY_SOURCE': args.recordings,
+        'REPLAY_ERROR_RATE': str(args.error_rate),
+        'REPLAY_ERROR_STATUS': str(args.error_status),
+        'REPLAY_TRUNCATE_RATE': str(args.truncate_rate),
+    }
+    if args.ttft is not None:
+        env['REPLAY_TTFT'] = str(args.ttft)
+    if args.chunk_delay is not None:
+        env['REPLAY_CHUNK_DELAY'] = str(args.chunk_delay)
+    if args.seed is not None:
+        env['REPLAY_SEED'] = str(args.seed)
+    return env
+
+
+def run_requests(call, total, concurrency):
+    """
+    Runs ``call()`` ``total`` times on ``concurrency`` threads.
+
+    ``call`` returns ``(ok, status)``. Returns the wall time and one
+    ``(latency_s, ok, status)`` tuple per call.
+    """
+    samples = []
+    lock = threading.Lock()
+
+    def one(_):
+        started = time.perf_counter()
+        try:
+            ok, status = call()
+        except Exception as e:
+            ok, status = False, type(e).__name__
+        latency = time.perf_counter() - started
+        with lock:
+            samples.append((latency, ok, status))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(total)))
+    return time.perf_counter() - started, samples
+
+
+def target_app(args, file_bytes):
+    os.environ.update(replay_env(args))
+    import metrics
+    from app import app
+
+    client = app.test_client()
+    url = f"{args.endpoint}?nocache=1"
+
+    def call():
+        response = client.post(url, data={'file': (io.BytesIO(file_bytes), 'bench.pdf')})
+        response.get_data()
+        return response.status_code == 200, response.status_code
+
+    for _ in range(args.warmup):
+        call()
+    before = metrics.process_stats()
+    wall, samples = run_requests(call, args.requests, args.concurrency)
+    after = metrics.process_stats()
+    return wall, samples, {
+        'cpu_s': after.get('cpu_seconds', 0) - before.get('cpu_seconds', 0),
+        'peak_rss_bytes': after.get('max_rss_bytes'),
+        'cpu_note': 'includes the in-process test client',
+    }
+
+
+def _multipart(file_bytes):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="bench.pdf"\r\n'
+        "Content-Type: application/pdf\r\n\r\n"
+    ).encode() + file_bytes + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def scrape_process(base_url):
+    """Reads the server's process CPU and RSS gauges from /metrics."""
+    with urllib.request.urlopen(f"{base_url}/metrics", timeout=30) as response:
+        text = response.read().decode()
+    stats = {}
+    for line in text.splitlines():
+        if line.startswith('extract_process{'):
+            key = line.split('"')[1]
+            stats[key] = float(line.rsplit(" ", 1)[1])
+    return stats
+
+
+def target_url(args, file_bytes):
+    base_url = args.url.rstrip("/")
+    body, content_type = _multipart(file_bytes)
+
+    def call():
+        req = urllib.request.Request(
+            f"{base_url}{args.endpoint}?nocache=1", data=body, headers={'Content-Type': content_type})
+        try:
+            with urllib.request.urlopen(req, timeout=args.timeout) as response:
+                response.read()
+                return True, response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return False, e.code
+
+    for _ in range(args.warmup):
+        call()
+    before = scrape_process(base_url)
+    wall, samples = run_requests(call, args.requests, args.concurrency)
+    after = scrape_process(base_url)
+    return wall, samples, {
+        'cpu_s': after.get('cpu_seconds', 0) - before.get('cpu_seconds', 0),
+        'peak_rss_bytes': after.get('max_rss_bytes'),
+    }
+
+
+def target_cli(args, file_path):
+    env = dict(os.environ, **replay_env(args))
+    command = [sys.executable, os.path.join(ROOT, 'app.py'), file_path, '--no-cache']
+    usage = {'cpu_s': 0.0, 'peak_rss_bytes': 0}
+    lock = threading.Lock()
+
+    def call():
+        process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # wait4 reports the CPU time and peak RSS of this child alone
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        with lock:
+            usage['cpu_s'] += rusage.ru_utime + rusage.ru_stime
+            usage['peak_rss_bytes'] = max(usage['peak_rss_bytes'], rusage.ru_maxrss * 1024)
+        return process.returncode == 0, process.returncode
+
+    wall, samples = run_requests(call, args.requests, args.concurrency)
+    usage['cpu_note'] = 'includes interpreter start-up'
+    return wall, samples, usage
+
+
+def summarize(args, wall, samples, usage):
+    latencies = [latency for latency, ok, _ in samples if ok]
+    statuses = {}
+    for _, _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = len(latencies)
+    result = {
+        'target': args.target,
+        'endpoint': args.endpoint if args.target != 'cli' else None,
+        'requests': len(samples),
+        'ok': ok,
+        'errors': len(samples) - ok,
+        'statuses': statuses,
+        'concurrency': args.concurrency,
+        'wall_s': round(wall, 3),
+        'throughput_rps': round(ok / wall, 3) if wall else None,
+        'mean_s': round(statistics.mean(latencies), 4) if latencies else None,
+        'p50_s': _round(percentile(latencies, 50)),
+        'p95_s': _round(percentile(latencies, 95)),
+        'p99_s': _round(percentile(latencies, 99)),
+        'max_s': _round(max(latencies) if latencies else None),
+        'cpu_s_per_request': round(usage['cpu_s'] / len(samples), 4) if samples else None,
+        'peak_rss_mb': round(usage['peak_rss_bytes'] / 1024 ** 2, 1) if usage.get('peak_rss_bytes') else None,
+        'replay': {
+            'recordings': args.recordings,
+            'ttft_s': args.ttft,
+            'chunk_delay_s': args.chunk_delay,
+            'error_rate': args.error_rate,
+            'error_status': args.error_status,
+            'truncate_rate': args.truncate_rate,
+        },
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+    if usage.get('cpu_note'):
+        result['cpu_note'] = usage['cpu_note']
+    return result
+
+
+def _round(value):
+    return round(value, 4) if value is not None else None
+
+
+def compare(result, baseline, max_regression):
+    """
+    Lists the metrics that got worse than ``baseline`` by more than ``max_regression``.
+
+    Returns:
+        list: Human-readable descriptions of each regression.
+    """
+    regressions = []
+    for key in REGRESSION_KEYS:
+        new, old = result.get(key), baseline.get(key)
+        if new is not None and old and new > old * (1 + max_regression):
+            regressions.append(f"{key}: {old} -> {new}")
+    new, old = result.get('throughput_rps'), baseline.get('throughput_rps')
+    if new is not None and old and new < old * (1 - max_regression):
+        regressions.append(f"throughput_rps: {old} -> {new}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the extraction request path against the replay backend.")
+    parser.add_argument("target", choices=("app", "url", "cli"), help="What to drive.")
+    parser.add_argument("-n", "--requests", type=int, default=100, help="Total extractions.")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="Extractions in flight at once.")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed extractions before the run (app and url).")
+    parser.add_argument("--endpoint", default="/upload", help="Endpoint for the app and url targets.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Server for the url target.")
+    parser.add_argument("--timeout", type=float, default=600, help="Per-request timeout for the url target.")
+    parser.add_argument("--file", help="Document to submit; a blank one-page PDF by default.")
+    parser.add_argument("--recordings", default=DEFAULT_RECORDINGS, help="Recording file or directory to replay.")
+    parser.add_argument("--ttft", type=float, help="Seconds to first chunk; recorded value by default.")
+    parser.add_argument("--chunk-delay", type=float, help="Seconds between chunks; recorded gaps by default.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of model calls that fail.")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of injected failures.")
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="Fraction of model calls cut off mid-stream.")
+    parser.add_argument("--seed", type=int, help="Seed for error injection.")
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against.")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed relative regression against the baseline.")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "rb") as f:
+            file_bytes = f.read()
+    else:
+        file_bytes = blank_pdf()
+
+    if args.target == 'app':
+        wall, samples, usage = target_app(args, file_bytes)
+    elif args.target == 'url':
+        wall, samples, usage = target_url(args, file_bytes)
+    else:
+        if args.file:
+            wall, samples, usage = target_cli(args, args.file)
+        else:
+            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+                f.write(file_bytes)
+            try:
+                wall, samples, usage = target_cli(args, f.name)
+            finally:
+                os.remove(f.name)
+
+    result = summarize(args, wall, samples, usage)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.max_regression)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Records real model streams for the replay backend.
+
+Each document is extracted once per variant against Vertex AI and the chunk
+sequence, timings and token usage are written to ``<output>/<name>.<variant>.json``.
+Point ``REPLAY_SOURCE`` at the output directory to replay them.
+
+Usage:
+    python benchmarks/record_responses.py bill1.pdf bill2.pdf -o recordings/ --variant full compact
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from documents import read_document, sniff_mime_type  # noqa: E402
+from extractor import VARIANTS, create_backend, load_config  # noqa: E402
+from replay import record_stream  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record model streams for the replay backend.")
+    parser.add_argument("files", nargs="+", help="Documents to extract.")
+    parser.add_argument("-o", "--output", required=True, help="Directory the recordings are written to.")
+    parser.add_argument("--variant", nargs="+", default=["full"], choices=sorted(VARIANTS),
+                        help="Prompt and schema variants to record.")
+    args = parser.parse_args()
+
+    extractor = create_backend(dict(load_config(), backend='gemini'))
+    os.makedirs(args.output, exist_ok=True)
+    for path in args.files:
+        file_bytes = read_document(path)
+        mime_type = sniff_mime_type(file_bytes)
+        name = os.path.splitext(os.path.basename(path))[0]
+        for variant in args.variant:
+            recording = record_stream(extractor, file_bytes, mime_type, variant)
+            target = os.path.join(args.output, f"{name}.{variant}.json")
+            with open(target, "w", encoding="utf-8") as f:
+                json.dump(recording, f)
+            print(f"{target}: {len(recording['chunks'])} chunks, ttft {recording['ttft_s']}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
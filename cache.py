@@ -0,0 +1,306 @@
+"""
+Content-addressed cache for extraction results.
+
+Results are keyed on a hash of the document bytes plus the extractor
+fingerprint (model name, prompt text and response schema), so a change to any
+of those naturally invalidates old entries. There are two tiers: a bounded
+in-memory LRU and an optional on-disk store with size and TTL eviction.
+Concurrent requests for the same key are coalesced into a single call.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_key(file_bytes, fingerprint):
+    """
+    Builds the cache key for a document.
+
+    Args:
+        file_bytes (bytes): The raw document contents.
+        fingerprint (str): Identifies the model, prompt and schema used.
+    Returns:
+        str: Hex digest identifying the result.
+    """
+    h = hashlib.sha256()
+    h.update(fingerprint.encode("utf-8"))
+    h.update(b"\0")
+    h.update(file_bytes)
+    return h.hexdigest()
+
+
+class _Flight:
+    """A computation in progress that other callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ResultCache:
+    """
+    Two-tier cache of extraction results with single-flight computation.
+
+    Args:
+        max_entries (int): Number of results kept in memory.
+        disk_dir (str): Directory for the persistent tier, or None to disable it.
+        disk_max_bytes (int): Size limit of the persistent tier.
+        ttl (float): Seconds before an on-disk entry expires.
+    """
+
+    def __init__(self, max_entries=128, disk_dir=None, disk_max_bytes=512 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk_bytes = None
+        self.counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'bypassed': 0,
+        }
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key):
+        """Returns the cached result for ``key`` or None."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return self._memory[key]
+        value = self._disk_get(key)
+        if value is not None:
+            with self._lock:
+                self.counters['disk_hits'] += 1
+                self._memory_put(key, value)
+        return value
+
+    def put(self, key, value):
+        """Stores ``value`` in both tiers."""
+        with self._lock:
+            self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def get_or_compute(self, key, compute, bypass=False):
+        """
+        Returns the cached result for ``key``, computing it at most once.
+
+        If another thread is already computing the same key, this call waits
+        for that result instead of starting a second computation.
+
+        Args:
+            key (str): Cache key from ``make_key()``.
+            compute (callable): Produces the result; only called on a miss.
+                Exceptions are propagated and nothing is cached.
+            bypass (bool): Skip the cache lookup and always call ``compute``.
+                The fresh result still replaces the cached one.
+        Returns:
+            str: The cached or freshly computed result.
+        """
+        if bypass:
+            with self._lock:
+                self.counters['bypassed'] += 1
+            value = compute()
+            self.put(key, value)
+            return value
+
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        flight, leader = self.begin(key)
+        if not leader:
+            return self.wait(flight)
+        try:
+            value = compute()
+        except Exception as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, value)
+        return value
+
+    def begin(self, key):
+        """
+        Starts computing ``key`` unless another caller already is.
+
+        For callers that produce the result themselves, e.g. while streaming
+        it to a client, instead of through ``get_or_compute()``.
+
+        Returns:
+            tuple: ``(flight, leader)``. The leader must call ``finish()``;
+            other callers get the leader's result from ``wait()``.
+        """
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self.counters['misses'] += 1
+            else:
+                self.counters['coalesced'] += 1
+        return flight, leader
+
+    def wait(self, flight):
+        """Blocks until ``flight`` finishes and returns its result or raises its error."""
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def finish(self, key, flight, value=None, error=None):
+        """Ends a computation started with ``begin()``, caching ``value`` unless it failed."""
+        try:
+            if error is None:
+                flight.result = value
+                self.put(key, value)
+            else:
+                flight.error = error
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+
+    def stats(self):
+        """Returns hit/miss counters and tier sizes."""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses'] + stats['coalesced']
+        stats['hit_ratio'] = (lookups - stats['misses']) / lookups if lookups else 0.0
+        if self.disk_dir:
+            stats['disk_bytes'] = self._disk_size()
+        return stats
+
+    def clear(self):
+        """Drops the in-memory tier."""
+        with self._lock:
+            self._memory.clear()
+
+    def _memory_put(self, key, value):
+        # Caller holds self._lock
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + ".json")
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            mtime = os.path.getmtime(path)
+            if self.ttl and time.time() - mtime > self.ttl:
+                self._disk_remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                value = f.read()
+            # Touch the entry so eviction drops the least recently used first
+            os.utime(path)
+            return value
+        except OSError:
+            return None
+
+    def _disk_put(self, key, value):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = value.encode("utf-8")
+        # Write to a temporary file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        with self._disk_lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += len(data) - replaced
+        if self._disk_size() > self.disk_max_bytes:
+            self._disk_evict()
+
+    def _disk_remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._disk_lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes -= size
+
+    def _disk_entries(self):
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _disk_size(self):
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+            return self._disk_bytes
+
+    def _disk_evict(self):
+        with self._disk_lock:
+            entries = sorted(self._disk_entries())
+            total = sum(size for _, size, _ in entries)
+            now = time.time()
+            for mtime, size, path in entries:
+                expired = self.ttl and now - mtime > self.ttl
+                if not expired and total <= self.disk_max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+            self._disk_bytes = total
+
+
+def create_cache():
+    """Builds a ``ResultCache`` from environment variables."""
+    return ResultCache(
+        max_entries=int(os.environ.get('RESULT_CACHE_SIZE', 128)),
+        disk_dir=os.environ.get('RESULT_CACHE_DIR') or None,
+        disk_max_bytes=int(os.environ.get('RESULT_CACHE_DISK_MAX_BYTES', 512 * 1024 * 1024)),
+        ttl=float(os.environ.get('RESULT_CACHE_TTL', 7 * 24 * 3600)),
+    )
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Returns the process-wide result cache, creating it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = create_cache()
+    return _cache
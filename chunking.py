@@ -0,0 +1,71 @@
+"""
+Page-chunked extraction for long PDFs.
+
+The document is split into page ranges that are extracted concurrently and
+merged back into a single ``line_details1`` array in document order. Every
+merged line item carries a 0-based ``pageIndex`` into the original document,
+since bounding boxes are normalized per page.
+"""
+import contextvars
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from compact import expand
+from documents import open_pdf, page_ranges, split_pdf
+
+
+def _extract_range(extractor, part_bytes, start, stop, compact):
+    """Extracts one page range and tags its line items with ``pageIndex``."""
+    single_page = stop - start == 1
+    if compact:
+        variant = "compact"
+    else:
+        variant = "full" if single_page else "paged"
+    result_text = extractor.generate(part_bytes, "application/pdf", variant)
+    try:
+        result = json.loads(result_text)
+    except ValueError as e:
+        raise ValueError(f"Invalid model response for pages {start + 1}-{stop}: {e}") from e
+    if compact:
+        result = expand(result, keep_page_numbers=True)
+
+    items = result.get("line_details1") or []
+    for item in items:
+        page_number = item.pop("pageNumber", None)
+        if single_page or not isinstance(page_number, int):
+            page_number = 1
+        # Clamp to the range in case the model reports a page outside the chunk
+        offset = min(max(page_number, 1), stop - start) - 1
+        item["pageIndex"] = start + offset
+    # The model does not always list items page by page within a chunk
+    items.sort(key=lambda item: item["pageIndex"])
+    return items
+
+
+def extract_chunked(extractor, pdf_bytes, chunk_pages, max_workers=4, compact=False):
+    """
+    Extracts a PDF in page ranges using a bounded pool of workers.
+
+    Args:
+        extractor (Extractor): Backend used for each page range.
+        pdf_bytes (bytes): The raw PDF contents.
+        chunk_pages (int): Maximum number of pages per model call.
+        max_workers (int): Maximum number of concurrent model calls.
+        compact (bool): Ask the model for the compact output format.
+    Returns:
+        dict: ``{"line_details1": [...]}`` with items in document order.
+    """
+    reader = open_pdf(pdf_bytes)
+    ranges = page_ranges(len(reader.pages), chunk_pages)
+    parts = split_pdf(reader, ranges)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(ranges)))) as executor:
+        futures = [
+            # Each worker gets a copy of the caller's context so stage timings land in its trace
+            executor.submit(contextvars.copy_context().run, _extract_range, extractor, part, start, stop, compact)
+            for part, (start, stop) in zip(parts, ranges)
+        ]
+        line_items = []
+        for future in futures:
+            line_items.extend(future.result())
+    return {"line_details1": line_items}
@@ -0,0 +1,83 @@
+"""
+Expansion of the compact model output format.
+
+In compact mode the model returns ``{"rows": [{"v": [...], "b": [...], "p": n}]}``
+where ``v`` lists the values of ``COMPACT_FIELDS`` in order, ``b`` holds the
+label and value bounding boxes of each of those fields (8 integers per field)
+and ``p`` is the page number. Fields with a fixed value are left out entirely.
+This module rebuilds the exact ``line_details1`` shape the full schema
+produces, so clients cannot tell which format the model used.
+"""
+import json
+
+from extractor import COMPACT_FIELDS, CONSTANT_FIELDS, LINE_ITEM_FIELDS
+
+EMPTY_BBOX = [0, 0, 0, 0]
+
+
+def _bbox(values):
+    # Pad short or malformed boxes so every field still has four coordinates
+    if len(values) != 4:
+        return list(EMPTY_BBOX)
+    return list(values)
+
+
+def expand_row(row):
+    """
+    Converts one compact row into a full line item.
+
+    Args:
+        row (dict): A compact row with ``v``, ``b`` and optionally ``p``.
+    Returns:
+        dict: Line item with ``value``/``labelBbox``/``valueBbox`` per field.
+            ``pageNumber`` is set when the row carries a page number.
+    """
+    values = row.get("v") or []
+    boxes = row.get("b") or []
+    compact = {}
+    for i, field in enumerate(COMPACT_FIELDS):
+        offset = 8 * i
+        compact[field] = {
+            "value": values[i] if i < len(values) else "",
+            "labelBbox": _bbox(boxes[offset:offset + 4]),
+            "valueBbox": _bbox(boxes[offset + 4:offset + 8]),
+        }
+
+    item = {}
+    for field in LINE_ITEM_FIELDS:
+        if field in CONSTANT_FIELDS:
+            item[field] = {
+                "value": CONSTANT_FIELDS[field],
+                "labelBbox": list(EMPTY_BBOX),
+                "valueBbox": list(EMPTY_BBOX),
+            }
+        else:
+            item[field] = compact[field]
+    if isinstance(row.get("p"), int):
+        item["pageNumber"] = row["p"]
+    return item
+
+
+def expand(result, keep_page_numbers=False):
+    """
+    Converts a parsed compact response into the full response shape.
+
+    Args:
+        result (dict): Parsed compact response.
+        keep_page_numbers (bool): Keep ``pageNumber`` on each item, e.g. for
+            page-chunked extraction. Dropped by default to match the full schema.
+    Returns:
+        dict: ``{"line_details1": [...]}``
+    """
+    items = []
+    for row in result.get("rows") or []:
+        item = expand_row(row)
+        if not keep_page_numbers:
+            item.pop("pageNumber", None)
+        items.append(item)
+    return {"line_details1": items}
+
+
+def expand_text(result_text, keep_page_numbers=False):
+    """Like ``expand()``, but takes and returns JSON text."""
+    return json.dumps(expand(json.loads(result_text), keep_page_numbers))
@@ -0,0 +1,170 @@
+"""
+Document helpers used before a document is sent to the model.
+
+``pypdf`` is only needed for the features that inspect or rewrite PDFs
+(page-chunked extraction, absolute box coordinates); plain extraction works
+without it.
+"""
+import io
+import os
+import shutil
+import tempfile
+
+try:
+    import pypdf
+except ImportError:  # pragma: no cover - optional dependency
+    pypdf = None
+
+
+# Leading bytes of the document formats Gemini accepts, checked in order
+MAGIC_NUMBERS = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+)
+
+
+def sniff_mime_type(data):
+    """
+    Detects the MIME type of a document from its contents.
+
+    Args:
+        data (bytes): The document, or at least its first kilobyte.
+    Returns:
+        str: The MIME type, or None if the format is not recognised.
+    """
+    # PDF readers accept the header anywhere in the first 1024 bytes
+    if b"%PDF-" in data[:1024]:
+        return "application/pdf"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    for magic, mime_type in MAGIC_NUMBERS:
+        if data.startswith(magic):
+            return mime_type
+    return None
+
+
+def read_document(source):
+    """
+    Reads a document from a path, a bytes object or a file-like object.
+
+    Args:
+        source (str | bytes | file): Where to read the document from.
+            File-like objects are read from the start when they can seek.
+    Returns:
+        bytes: The document contents.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    if hasattr(source, "read"):
+        # SpooledTemporaryFile has seek() but only gained seekable() in Python 3.11
+        seekable = getattr(source, "seekable", None)
+        if hasattr(source, "seek") and (seekable is None or seekable()):
+            source.seek(0)
+        return source.read()
+    with open(os.fspath(source), "rb") as f:
+        return f.read()
+
+
+def spool(stream, max_memory):
+    """
+    Copies a stream into a buffer that moves to an anonymous temporary file
+    once it grows beyond ``max_memory`` bytes.
+
+    Returns:
+        tempfile.SpooledTemporaryFile: The buffer, positioned at the start.
+    """
+    buffer = tempfile.SpooledTemporaryFile(max_size=max_memory)
+    shutil.copyfileobj(stream, buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def _require_pypdf(feature):
+    if pypdf is None:
+        raise RuntimeError(f"pypdf is required for {feature}. Install it with `pip install pypdf`.")
+
+
+def open_pdf(pdf_bytes):
+    """
+    Parses a PDF held in memory.
+
+    Args:
+        pdf_bytes (bytes): The raw PDF contents.
+    Returns:
+        pypdf.PdfReader: Reader over the document.
+    """
+    _require_pypdf("reading PDF pages")
+    return pypdf.PdfReader(io.BytesIO(pdf_bytes))
+
+
+def page_count(pdf_bytes):
+    """Returns the number of pages in a PDF."""
+    return len(open_pdf(pdf_bytes).pages)
+
+
+def page_sizes(pdf_bytes):
+    """
+    Returns the displayed size of each page of a PDF.
+
+    Returns:
+        list: ``(width, height)`` in PDF points per page, with ``/Rotate``
+        applied so the sizes match what the model saw.
+    """
+    sizes = []
+    for page in open_pdf(pdf_bytes).pages:
+        box = page.mediabox
+        width, height = float(box.width), float(box.height)
+        if (page.rotation or 0) % 180:
+            width, height = height, width
+        sizes.append((width, height))
+    return sizes
+
+
+def try_page_count(pdf_bytes):
+    """Returns the number of pages in a PDF, or None if it cannot be determined."""
+    if pypdf is None:
+        return None
+    try:
+        return page_count(pdf_bytes)
+    except Exception:
+        return None
+
+
+def page_ranges(total_pages, chunk_pages):
+    """
+    Splits ``total_pages`` into consecutive ranges of at most ``chunk_pages``.
+
+    Returns:
+        list: ``(start, stop)`` tuples of 0-based page indices, stop exclusive.
+    """
+    if chunk_pages < 1:
+        raise ValueError("chunk_pages must be at least 1")
+    return [
+        (start, min(start + chunk_pages, total_pages))
+        for start in range(0, total_pages, chunk_pages)
+    ]
+
+
+def split_pdf(reader, ranges):
+    """
+    Writes each page range of a PDF to a standalone document.
+
+    Args:
+        reader (pypdf.PdfReader): The source document.
+        ranges (list): ``(start, stop)`` tuples from ``page_ranges()``.
+    Returns:
+        list: PDF bytes for each range, in the same order.
+    """
+    parts = []
+    for start, stop in ranges:
+        writer = pypdf.PdfWriter()
+        for index in range(start, stop):
+            writer.add_page(reader.pages[index])
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        parts.append(buffer.getvalue())
+    return parts
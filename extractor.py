@@ -0,0 +1,807 @@
+"""
+Extraction backends for the bounding box extractor.
+
+An extractor owns everything that is expensive to build for a model call: the
+Vertex AI client (and its pooled HTTP connections), the prompt and the
+``GenerateContentConfig`` with the full response schema. One instance is
+created per process via ``get_extractor()`` and shared by the Flask routes and
+the CLI.
+"""
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import threading
+
+import metrics
+
+PROMPT = """Identify the tags and extract bounding box coordinates for both labels and values. 
+For each extracted field, provide normalized bounding box coordinates in the format [y_min, x_min, y_max, x_max] 
+where coordinates are normalized to a scale of 0-1000 (multiply actual coordinates by 1000 and divide by document dimensions).
+Extract bounding boxes for both the field label (if visible) and the field value. 
+If a label is not visible on the document, return empty bounding box [0, 0, 0, 0] for the label.
+Always provide bounding box coordinates for values when they exist."""
+
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "line_details1": {
+            "type": "array",
+            "description": "Contains a list of line item details. Include total and subtotal rows as well.",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "claimId": {
+                        "type": "object",
+                        "properties": {
+                            "value": {"type": "string", "description": "Return an empty string."},
+                            "labelBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
+                            },
+                            "valueBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
+                            }
+                        }
+                    },
+                    "lineId": {
+                        "type": "object",
+                        "properties": {
+                            "value": {"type": "string", "description": "Return an empty string."},
+                            "labelBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
+                            },
+                            "valueBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
+                            }
+                        }
+                    },
+                    "serviceDateTime": {
+                        "type": "object",
+                        "properties": {
+                            "value": {"type": "string", "description": "Extract the 'Reference Date', 'service date', 'Registry Rate' or any Date mentioned in MM-DD-YYYY format. If these values are present within the line item, extract them from the line item. If these values are not present within the line item, extract them from the header section. If the current row is an 'ITEM' row, return the extracted 'service date'. If the current row is a 'SECTION TOTAL' or 'TOTAL' row, return an empty string for 'service date'."},
+                            "labelBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
+                            },
+                            "valueBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
+                            }
+                        }
+                    },
+                    "itemCode": {
+                        "type": "object",
+                        "properties": {
+                            "value": {"type": "string", "description": "Extract ONLY the value corresponding to 'Item Code' or 'Item ID', ONLY IF the KEY exists on the document. UNMISTAKABLY capture only if the tags or label matches. Preserve all original characters and spacing; Do not perform any auto-correction or modification of the extracted value. Other TAGS like 'Registry Number', 'slip no', 'Order No', or 'Document Number' or  column without any header should be IGNORED and SHOULD NOT be CAPTURED. UNMISTABLY, Ignore extraction If the headers 'Item Code' or 'Item ID' are not found, do not return any value as the item code."},
+                            "labelBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
+                            },
+                            "valueBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
+                            }
+                        }
+                    },
+                    "dataSource": {
+                        "type": "object",
+                        "properties": {
+                            "value": {"type": "string", "description": "Keep the field value as 'OCR'.", "enum": ["OCR"]},
+                            "labelBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
+                            },
+                            "valueBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
+                            }
+                        }
+                    },
+                    "lineTypeSectionTotalItem": {
+                        "type": "object",
+                        "properties": {
+                            "value": {"type": "string", "description": "Return as 'ITEM' if the row is ITEM. Return as 'SECTION TOTAL' if the row is section total or Total. Return an empty string if not applicable or unknown.", "enum": ["ITEM", "SECTION TOTAL", ""]},
+                            "labelBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
+                            },
+                            "valueBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
+                            }
+                        }
+                    },
+                    "sectionHeaderLineSectionType": {
+                        "type": "object",
+                        "properties": {
+                            "value": {"type": "string", "description": "For each line item, extract the DEPT code, DEFT code, Income center, Department, and medical department type (e.g., Laboratory, EYE Center, etc.). Prioritize extraction from the line item itself, and use the header section as a fallback source if these values are missing, as these codes and department types typically indicate the item's section or grouping. Ensure that the text extraction remains continuous and does not terminate upon encountering a special character within a word. You must also return the complete section header relevant to the line item; if the required data and the relevant header cannot be found, return an empty string."},
+                            "labelBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
+                            },
+                            "valueBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
+                            }
+                        }
+                    },
+                    "billsParticularsCostCenters": {
+                        "type": "object",
+                        "properties": {
+                            "value": {"type": "string", "description": "Extract the 'Item Description' or 'Description' or 'Items'. Return an empty string if not found."},
+                            "labelBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
+                            },
+                            "valueBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
+                            }
+                        }
+                    },
+                    "qty": {
+                        "type": "object",
+                        "properties": {
+                            "value": {"type": "string", "description": "Extract the 'QTY' or 'Quantity'. Return an empty string if not found."},
+                            "labelBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
+                            },
+                            "valueBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
+                            }
+                        }
+                    },
+                    "price": {
+                        "type": "object",
+                        "properties": {
+                            "value": {"type": "string", "description": "Extract the 'price'. Return an empty string if not found."},
+                            "labelBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
+                            },
+                            "valueBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
+                            }
+                        }
+                    },
+                    "discount": {
+                        "type": "object",
+                        "properties": {
+                            "value": {"type": "string", "description": "Extract the 'discount'. If it is '0.00' return '0.00' only. Return an empty string if not found (unless it's '0.00')."},
+                            "labelBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
+                            },
+                            "valueBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
+                            }
+                        }
+                    },
+                    "discountPercent": {
+                        "type": "object",
+                        "properties": {
+                            "value": {"type": "string", "description": "Extract the 'discount percent'. Return an empty string if not found."},
+                            "labelBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
+                            },
+                            "valueBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
+                            }
+                        }
+                    },
+                    "paidByPatientHospitalBill": {
+                        "type": "object",
+                        "properties": {
+                            "value": {"type": "string", "description": "Extract the 'paidByPatientHospitalBill'. Return an empty string if not found."},
+                            "labelBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
+                            },
+                            "valueBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
+                            }
+                        }
+                    },
+                    "philhealthHospBillPortionAmount": {
+                        "type": "object",
+                        "properties": {
+                            "value": {"type": "string", "description": "Extract the 'philhealthHospBillPortionAmount'. Return an empty string if not found."},
+                            "labelBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
+                            },
+                            "valueBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
+                            }
+                        }
+                    },
+                    "billsParticularsCostCenterAmount": {
+                        "type": "object",
+                        "properties": {
+                            "value": {"type": "string", "description": "Extract the 'Gross Amount' or 'Gross AMT' or 'Total Amount' or 'Amount' or 'Hospital'. Return an empty string if not found."},
+                            "labelBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for label [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if label not visible."
+                            },
+                            "valueBbox": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "description": "Normalized bounding box for value [y_min, x_min, y_max, x_max] scaled 0-1000. Empty [0,0,0,0] if value not found."
+                            }
+                        }
+                    }
+                },
+                "required": [
+                    "claimId",
+                    "lineId",
+                    "serviceDateTime",
+                    "itemCode",
+                    "dataSource",
+                    "lineTypeSectionTotalItem",
+                    "sectionHeaderLineSectionType",
+                    "billsParticularsCostCenters",
+                    "qty",
+                    "price",
+                    "discount",
+                    "discountPercent",
+                    "paidByPatientHospitalBill",
+                    "philhealthHospBillPortionAmount",
+                    "billsParticularsCostCenterAmount"
+                ]
+            }
+        }
+    }
+}
+
+PAGED_PROMPT = PROMPT + """
+The document may span several pages. Bounding boxes are normalized to the page the field appears on.
+For each line item, return the 1-based page number within the provided document in pageNumber."""
+
+PAGED_RESPONSE_SCHEMA = copy.deepcopy(RESPONSE_SCHEMA)
+_paged_item = PAGED_RESPONSE_SCHEMA["properties"]["line_details1"]["items"]
+_paged_item["properties"]["pageNumber"] = {
+    "type": "integer",
+    "description": "1-based page number within the provided document on which the line item appears."
+}
+_paged_item["required"].append("pageNumber")
+
+LINE_ITEM_FIELDS = list(RESPONSE_SCHEMA["properties"]["line_details1"]["items"]["properties"])
+
+# Fields whose value the schema fixes; the compact format leaves them out
+CONSTANT_FIELDS = {
+    "claimId": "",
+    "lineId": "",
+    "dataSource": "OCR",
+}
+
+COMPACT_FIELDS = [field for field in LINE_ITEM_FIELDS if field not in CONSTANT_FIELDS]
+
+
+def _compact_prompt():
+    item_properties = RESPONSE_SCHEMA["properties"]["line_details1"]["items"]["properties"]
+    lines = [
+        f"{i}. {field}: {item_properties[field]['properties']['value']['description']}"
+        for i, field in enumerate(COMPACT_FIELDS)
+    ]
+    return PROMPT + """
+Return one entry in "rows" per line item, including total and subtotal rows.
+"v" holds the field values as strings, in exactly this order:
+""" + "\n".join(lines) + f"""
+"b" holds {8 * len(COMPACT_FIELDS)} integers: for each field above, in the same order, the label bounding box followed by the value bounding box (8 integers per field).
+"p" is the 1-based page number on which the line item appears."""
+
+
+COMPACT_PROMPT = _compact_prompt()
+
+COMPACT_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "rows": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "v": {"type": "array", "items": {"type": "string"}},
+                    "b": {"type": "array", "items": {"type": "integer"}},
+                    "p": {"type": "integer"}
+                },
+                "required": ["v", "b"]
+            }
+        }
+    },
+    "required": ["rows"]
+}
+
+# Field descriptions for the text variant. Values are located in the PDF text
+# layer, so unlike the full schema they ask for the printed text verbatim and
+# never for a reformatted or default value.
+TEXT_FIELD_DESCRIPTIONS = {
+    "serviceDateTime": "The service or reference date of the line item as printed, from the line item or, if it has none, from the header section.",
+    "itemCode": "The printed 'Item Code' or 'Item ID', only if such a label exists on the document.",
+    "lineTypeSectionTotalItem": "'ITEM' for an item row, 'SECTION TOTAL' for a section total or total row.",
+    "sectionHeaderLineSectionType": "The DEPT code, income center, department or section header the line item belongs to, as printed.",
+    "billsParticularsCostCenters": "The item description as printed.",
+    "qty": "The quantity as printed.",
+    "price": "The unit price as printed.",
+    "discount": "The discount as printed.",
+    "discountPercent": "The discount percent as printed.",
+    "paidByPatientHospitalBill": "The amount paid by the patient as printed.",
+    "philhealthHospBillPortionAmount": "The PhilHealth portion of the hospital bill as printed.",
+    "billsParticularsCostCenterAmount": "The 'Gross Amount', 'Total Amount', 'Amount' or 'Hospital' value as printed.",
+}
+
+
+def _text_prompt():
+    lines = [f"{i}. {field}: {TEXT_FIELD_DESCRIPTIONS[field]}" for i, field in enumerate(COMPACT_FIELDS)]
+    return """Identify the line items of this bill. Do not return any coordinates; only text.
+Copy every value exactly as it is printed on the document, including punctuation, so it can be found in the document text.
+Do not reformat dates or numbers and do not fill in values that are not printed.
+Return one entry in "rows" per line item, including total and subtotal rows.
+"v" holds the field values as strings, in exactly this order (empty string if the field is not present):
+""" + "\n".join(lines) + """
+"p" is the 1-based page number on which the line item appears.
+"labels" holds, in the same order, the label or column header printed for each field (empty string if there is none)."""
+
+
+TEXT_PROMPT = _text_prompt()
+
+# Values only; bounding boxes are resolved locally from the PDF text layer
+TEXT_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "labels": {"type": "array", "items": {"type": "string"}},
+        "rows": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "v": {"type": "array", "items": {"type": "string"}},
+                    "p": {"type": "integer"}
+                },
+                "required": ["v", "p"]
+            }
+        }
+    },
+    "required": ["labels", "rows"]
+}
+
+# Prompt and response schema pairs an extractor can be asked to use
+VARIANTS = {
+    "full": (PROMPT, RESPONSE_SCHEMA),
+    "paged": (PAGED_PROMPT, PAGED_RESPONSE_SCHEMA),
+    "compact": (COMPACT_PROMPT, COMPACT_RESPONSE_SCHEMA),
+    "text": (TEXT_PROMPT, TEXT_RESPONSE_SCHEMA),
+}
+
+SAFETY_CATEGORIES = (
+    "HARM_CATEGORY_HATE_SPEECH",
+    "HARM_CATEGORY_DANGEROUS_CONTENT",
+    "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+    "HARM_CATEGORY_HARASSMENT",
+)
+
+DEFAULT_PROJECT = "ng-project-102"
+DEFAULT_LOCATION = "global"
+DEFAULT_MODEL = "gemini-3-pro-preview"
+# Faster model for simple documents when routing is enabled (see routing.py)
+DEFAULT_LIGHT_MODEL = "gemini-2.5-flash"
+
+
+def schema_fingerprint(model, prompt, schema):
+    """
+    Identifies the inputs that determine a model response besides the document.
+
+    Args:
+        model (str): The model name.
+        prompt (str): The prompt text.
+        schema (dict): The response schema.
+    Returns:
+        str: Hex digest used as part of result cache keys.
+    """
+    h = hashlib.sha256()
+    for part in (model, prompt, json.dumps(schema, sort_keys=True)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def error_status(exc):
+    """
+    Returns the HTTP status code carried by a model API error, if any.
+
+    ``google.genai.errors.APIError`` exposes it as ``code``; other exceptions
+    return None.
+    """
+    code = getattr(exc, 'code', None)
+    return code if isinstance(code, int) else None
+
+
+def _hedge_after(value):
+    # "p95" hedges at the observed 95th percentile; a number is a fixed delay in seconds
+    if not value:
+        return None
+    return value if value == "p95" else float(value)
+
+
+def _optional_float(value):
+    return float(value) if value not in (None, "") else None
+
+
+def load_config():
+    """
+    Reads the extractor configuration from the environment.
+
+    Returns:
+        dict: Backend name, Vertex AI project/location, model name and
+        generation limits, fake backend options, the deadline/retry/hedging
+        policy and the routing tiers.
+    """
+    return {
+        'backend': os.environ.get('EXTRACTOR_BACKEND', 'gemini'),
+        'project': os.environ.get('GOOGLE_CLOUD_PROJECT', DEFAULT_PROJECT),
+        'location': os.environ.get('GOOGLE_CLOUD_LOCATION', DEFAULT_LOCATION),
+        'model': os.environ.get('GEMINI_MODEL', DEFAULT_MODEL),
+        'thinking_budget': int(os.environ.get('THINKING_BUDGET', -1)),
+        'max_output_tokens': int(os.environ.get('MAX_OUTPUT_TOKENS', 65535)),
+        'stub_response_file': os.environ.get('STUB_RESPONSE_FILE'),
+        'replay_source': os.environ.get('REPLAY_SOURCE'),
+        'replay_ttft': _optional_float(os.environ.get('REPLAY_TTFT')),
+        'replay_chunk_delay': _optional_float(os.environ.get('REPLAY_CHUNK_DELAY')),
+        'replay_error_rate': float(os.environ.get('REPLAY_ERROR_RATE', 0)),
+        'replay_error_status': int(os.environ.get('REPLAY_ERROR_STATUS', 503)),
+        'replay_truncate_rate': float(os.environ.get('REPLAY_TRUNCATE_RATE', 0)),
+        'replay_seed': int(os.environ['REPLAY_SEED']) if os.environ.get('REPLAY_SEED') else None,
+        'deadline': float(os.environ.get('REQUEST_DEADLINE', 300)),
+        'max_attempts': int(os.environ.get('RETRY_MAX_ATTEMPTS', 3)),
+        'retry_base_delay': float(os.environ.get('RETRY_BASE_DELAY', 1)),
+        'retry_max_delay': float(os.environ.get('RETRY_MAX_DELAY', 30)),
+        'hedge_after': _hedge_after(os.environ.get('HEDGE_AFTER', '')),
+        'hedge_min_samples': int(os.environ.get('HEDGE_MIN_SAMPLES', 20)),
+        'routing': os.environ.get('ROUTING') == '1',
+        'routing_light_model': os.environ.get('ROUTING_LIGHT_MODEL', DEFAULT_LIGHT_MODEL),
+        'routing_light_thinking_budget': int(os.environ.get('ROUTING_LIGHT_THINKING_BUDGET', 1024)),
+        'routing_light_max_output_tokens': int(os.environ.get('ROUTING_LIGHT_MAX_OUTPUT_TOKENS', 32768)),
+        'routing_light_max_pages': int(os.environ.get('ROUTING_LIGHT_MAX_PAGES', 2)),
+        'routing_light_max_bytes': int(os.environ.get('ROUTING_LIGHT_MAX_BYTES', 2 * 1024 * 1024)),
+        'routing_max_mismatch': float(os.environ.get('ROUTING_MAX_MISMATCH', 0.2)),
+        'routing_light_deadline': float(os.environ.get('ROUTING_LIGHT_DEADLINE', 60)),
+    }
+
+
+class Extractor:
+    """
+    Interface shared by all extraction backends.
+
+    Subclasses implement ``stream()``; ``generate()`` collects the stream into
+    a single JSON string. ``variant`` selects a prompt and response schema
+    pair from ``VARIANTS``.
+    """
+
+    model = None
+
+    def stats(self):
+        """Returns backend counters; empty for backends that keep none."""
+        return {}
+
+    def fingerprint(self, variant="full"):
+        """
+        Identifies the model, prompt and schema used for ``variant``.
+
+        Returns:
+            str: Hex digest used as part of result cache keys.
+        """
+        prompt, schema = VARIANTS[variant]
+        return schema_fingerprint(self.model, prompt, schema)
+
+    def stream(self, file_bytes, mime_type, variant="full"):
+        """
+        Streams the model response for a document.
+
+        Args:
+            file_bytes (bytes): The raw document contents.
+            mime_type (str): The MIME type of the document.
+            variant (str): Name of the prompt and schema pair to use.
+        Yields:
+            str: Chunks of the JSON response text.
+        """
+        raise NotImplementedError
+
+    def generate(self, file_bytes, mime_type, variant="full"):
+        """
+        Extracts the tags from a document.
+
+        Args:
+            file_bytes (bytes): The raw document contents.
+            mime_type (str): The MIME type of the document.
+            variant (str): Name of the prompt and schema pair to use.
+        Returns:
+            str: JSON string containing the extracted tags
+        """
+        return "".join(self.stream(file_bytes, mime_type, variant))
+
+    async def astream(self, file_bytes, mime_type, variant="full"):
+        """
+        Async counterpart of ``stream()``.
+
+        The default implementation runs ``stream()`` in a worker thread; backends
+        with a native async client override it.
+        """
+        iterator = iter(self.stream(file_bytes, mime_type, variant))
+        sentinel = object()
+        while True:
+            chunk = await asyncio.to_thread(next, iterator, sentinel)
+            if chunk is sentinel:
+                return
+            yield chunk
+
+    async def agenerate(self, file_bytes, mime_type, variant="full"):
+        """Async counterpart of ``generate()``."""
+        parts = []
+        async for chunk in self.astream(file_bytes, mime_type, variant):
+            parts.append(chunk)
+        return "".join(parts)
+
+
+class GeminiExtractor(Extractor):
+    """
+    Extractor backed by Gemini on Vertex AI.
+
+    Args:
+        project (str): Google Cloud project.
+        location (str): Vertex AI location.
+        model (str): Model name.
+        thinking_budget (int): Thinking tokens per call; -1 lets the model decide.
+        max_output_tokens (int): Upper bound for the response length.
+    """
+
+    def __init__(self, project, location, model, thinking_budget=-1, max_output_tokens=65535):
+        from google import genai
+        from google.genai import types
+
+        self._types = types
+        self.model = model
+        self.thinking_budget = thinking_budget
+        self.max_output_tokens = max_output_tokens
+        self.client = genai.Client(
+            vertexai=True,
+            project=project,
+            location=location,
+        )
+        self.prompt_parts = {}
+        self.configs = {}
+        for name, (prompt, schema) in VARIANTS.items():
+            self.prompt_parts[name] = types.Part.from_text(text=prompt)
+            self.configs[name] = self._build_config(schema)
+
+    def _build_config(self, schema):
+        types = self._types
+        return types.GenerateContentConfig(
+            temperature=1,
+            top_p=1,
+            max_output_tokens=self.max_output_tokens,
+            safety_settings=[
+                types.SafetySetting(category=category, threshold="OFF")
+                for category in SAFETY_CATEGORIES
+            ],
+            response_mime_type="application/json",
+            response_schema=schema,
+            thinking_config=types.ThinkingConfig(
+                thinking_budget=self.thinking_budget,
+            ),
+        )
+
+    def fingerprint(self, variant="full"):
+        fingerprint = super().fingerprint(variant)
+        # Default settings keep the cache keys results were stored under before they were configurable
+        if (self.thinking_budget, self.max_output_tokens) != (-1, 65535):
+            fingerprint = schema_fingerprint(fingerprint, str(self.thinking_budget), self.max_output_tokens)
+        return fingerprint
+
+    def build_contents(self, file_bytes, mime_type, variant="full"):
+        """Builds the request contents: the variant's prompt followed by the document."""
+        types = self._types
+        file_part = types.Part.from_bytes(
+            data=file_bytes,
+            mime_type=mime_type,
+        )
+        return [
+            types.Content(
+                role="user",
+                parts=[self.prompt_parts[variant], file_part],
+            )
+        ]
+
+    def stream(self, file_bytes, mime_type, variant="full"):
+        timer = metrics.StreamTimer()
+        try:
+            for chunk in self.client.models.generate_content_stream(
+                model=self.model,
+                contents=self.build_contents(file_bytes, mime_type, variant),
+                config=self.configs[variant],
+            ):
+                timer.chunk(chunk.usage_metadata)
+                if chunk.text:
+                    yield chunk.text
+        finally:
+            timer.finish()
+
+    async def astream(self, file_bytes, mime_type, variant="full"):
+        timer = metrics.StreamTimer()
+        try:
+            # The async client shares the pooled connections of self.client
+            async for chunk in await self.client.aio.models.generate_content_stream(
+                model=self.model,
+                contents=self.build_contents(file_bytes, mime_type, variant),
+                config=self.configs[variant],
+            ):
+                timer.chunk(chunk.usage_metadata)
+                if chunk.text:
+                    yield chunk.text
+        finally:
+            timer.finish()
+
+
+class StubExtractor(Extractor):
+    """
+    Local extractor that returns a canned response without calling the model.
+
+    Useful for tests and for running the web UI without Vertex AI access.
+    """
+
+    model = "stub"
+
+    def __init__(self, response_text=None):
+        if response_text is None:
+            response_text = json.dumps({"line_details1": []})
+        self.response_text = response_text
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(f.read())
+
+    def fingerprint(self, variant="full"):
+        return schema_fingerprint(self.model, self.response_text, {"variant": variant})
+
+    def stream(self, file_bytes, mime_type, variant="full"):
+        yield self.response_text
+
+    async def astream(self, file_bytes, mime_type, variant="full"):
+        yield self.response_text
+
+
+def create_backend(settings):
+    """Builds the bare extraction backend named by ``settings['backend']``."""
+    backend = settings['backend']
+    if backend == 'gemini':
+        return GeminiExtractor(
+            project=settings['project'],
+            location=settings['location'],
+            model=settings['model'],
+            thinking_budget=settings.get('thinking_budget', -1),
+            max_output_tokens=settings.get('max_output_tokens', 65535),
+        )
+    if backend == 'stub':
+        if settings.get('stub_response_file'):
+            return StubExtractor.from_file(settings['stub_response_file'])
+        return StubExtractor()
+    if backend == 'replay':
+        if not settings.get('replay_source'):
+            raise ValueError("The replay backend needs REPLAY_SOURCE (a recording file or directory).")
+        from replay import ReplayExtractor
+        return ReplayExtractor.from_settings(settings)
+    raise ValueError(f"Unknown extractor backend: {backend}")
+
+
+def create_extractor(config=None):
+    """
+    Builds an extractor for the configured backend.
+
+    The backend is wrapped in a ``ResilientExtractor`` that applies the
+    configured deadline, retry and hedging policy. With ``ROUTING=1`` a light
+    and a heavy backend are built and wrapped in a ``RoutingExtractor`` (see
+    ``routing.py``).
+
+    Args:
+        config (dict): Overrides for the values returned by ``load_config()``.
+    Returns:
+        Extractor: A ready-to-use extraction backend.
+    """
+    from resilience import ResilientExtractor
+
+    settings = load_config()
+    settings.update(config or {})
+
+    def resilient(backend_settings, deadline=settings['deadline'], retry_invalid=True):
+        return ResilientExtractor(
+            create_backend(backend_settings),
+            deadline=deadline,
+            max_attempts=settings['max_attempts'],
+            base_delay=settings['retry_base_delay'],
+            max_delay=settings['retry_max_delay'],
+            hedge_after=settings['hedge_after'],
+            hedge_min_samples=settings['hedge_min_samples'],
+            retry_invalid=retry_invalid,
+        )
+
+    if not settings['routing']:
+        return resilient(settings)
+    from routing import RoutingExtractor
+    light = dict(
+        settings,
+        model=settings['routing_light_model'],
+        thinking_budget=settings['routing_light_thinking_budget'],
+        max_output_tokens=settings['routing_light_max_output_tokens'],
+    )
+    return RoutingExtractor(
+        # Invalid light responses are escalated, not retried: truncation at the output limit repeats
+        resilient(light, deadline=settings['routing_light_deadline'], retry_invalid=False),
+        resilient(settings),
+        light_max_pages=settings['routing_light_max_pages'],
+        light_max_bytes=settings['routing_light_max_bytes'],
+        max_mismatch=settings['routing_max_mismatch'],
+        deadline=settings['deadline'],
+    )
+
+
+_extractor = None
+_extractor_lock = threading.Lock()
+
+
+def get_extractor():
+    """Returns the process-wide extractor, creating it on first use."""
+    global _extractor
+    if _extractor is None:
+        with _extractor_lock:
+            if _extractor is None:
+                _extractor = create_extractor()
+    return _extractor
+
+
+def set_extractor(extractor):
+    """Replaces the process-wide extractor, e.g. with a ``StubExtractor`` in tests."""
+    global _extractor
+    with _extractor_lock:
+        _extractor = extractor
@@ -0,0 +1,136 @@
+"""
+Background job queue for asynchronous extraction.
+
+Jobs are accepted into a bounded queue and processed by a fixed pool of worker
+threads, so slow documents no longer hold HTTP workers. When the queue is full
+``submit()`` raises ``QueueFull`` and the caller should ask the client to retry
+later. Finished jobs are kept for a retention window and then dropped.
+"""
+import threading
+import time
+import uuid
+from collections import deque
+from queue import Full, Queue
+
+
+class QueueFull(Exception):
+    """Raised when a job cannot be accepted because the queue is full."""
+
+    def __init__(self, retry_after):
+        super().__init__("Job queue is full")
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    """
+    Bounded queue of extraction jobs processed by worker threads.
+
+    Args:
+        handler (callable): Called with the job's arguments; its return value
+            becomes the job result. Exceptions mark the job as failed.
+        workers (int): Number of worker threads.
+        max_pending (int): Maximum number of jobs waiting to start.
+        retention (float): Seconds a finished job stays available.
+        cleanup (callable): Optional; called with the job's arguments after
+            the job finishes, whether or not it succeeded.
+    """
+
+    def __init__(self, handler, workers=2, max_pending=16, retention=3600, cleanup=None):
+        self.handler = handler
+        self.cleanup = cleanup
+        self.workers = workers
+        self.retention = retention
+        self._queue = Queue(maxsize=max_pending)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        # Recent job durations, used to estimate Retry-After
+        self._durations = deque(maxlen=50)
+
+    def submit(self, *args):
+        """
+        Queues a job.
+
+        Returns:
+            str: The new job id.
+        Raises:
+            QueueFull: If no more jobs can be accepted right now.
+        """
+        self._start_workers()
+        self._purge()
+        job_id = uuid.uuid4().hex
+        job = {
+            'job_id': job_id,
+            'status': 'queued',
+            'created_at': time.time(),
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+        try:
+            self._queue.put_nowait((job_id, args))
+        except Full:
+            with self._lock:
+                del self._jobs[job_id]
+            raise QueueFull(self.retry_after())
+        return job_id
+
+    def get(self, job_id):
+        """Returns a snapshot of the job, or None if it is unknown or expired."""
+        self._purge()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def retry_after(self):
+        """Estimates the seconds until a queue slot frees up."""
+        with self._lock:
+            durations = list(self._durations)
+        average = sum(durations) / len(durations) if durations else 10.0
+        return max(1, int(average * (self._queue.qsize() + 1) / self.workers))
+
+    def stats(self):
+        """Returns queue depth and job counts by status."""
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+        return {'pending': self._queue.qsize(), 'jobs': counts}
+
+    def _start_workers(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job_id, args = self._queue.get()
+            started = time.time()
+            with self._lock:
+                self._jobs[job_id].update(status='running', started_at=started)
+            try:
+                result = self.handler(*args)
+                update = {'status': 'done', 'result': result}
+            except Exception as e:
+                update = {'status': 'failed', 'error': str(e)}
+            finally:
+                if self.cleanup is not None:
+                    self.cleanup(*args)
+            finished = time.time()
+            with self._lock:
+                self._durations.append(finished - started)
+                self._jobs[job_id].update(update, finished_at=finished)
+            self._queue.task_done()
+
+    def _purge(self):
+        cutoff = time.time() - self.retention
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.get('finished_at', float('inf')) < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
@@ -0,0 +1,114 @@
+"""
+Incremental parser for the streamed model response.
+
+The model streams a single JSON object of the form
+``{"line_details1": [{...}, {...}]}``. ``LineItemParser`` consumes the text
+chunk by chunk and hands back each line item as soon as its closing brace
+arrives, without re-scanning what it has already seen.
+"""
+import json
+import re
+
+# Characters that can change the parser state; everything else is skipped in bulk
+_SPECIAL = re.compile(r'[{}\[\]"\\]')
+# Inside a string only quotes and backslashes matter
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+
+class LineItemParser:
+    """
+    Emits completed ``line_details1`` items from a chunked JSON stream.
+
+    Args:
+        array_key (str): Top-level key holding the list of line items.
+    """
+
+    def __init__(self, array_key="line_details1"):
+        self.array_key = array_key
+        self._chunks = []
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._key_parts = None
+        self._last_key = None
+        self._items_depth = None
+        self._item_parts = None
+        self.count = 0
+
+    @property
+    def text(self):
+        """The full response text received so far."""
+        return "".join(self._chunks)
+
+    def feed(self, chunk):
+        """
+        Consumes the next piece of response text.
+
+        Args:
+            chunk (str): Text as it arrived from the model.
+        Returns:
+            list: Line items (dicts) completed by this chunk, in order.
+        """
+        self._chunks.append(chunk)
+        items = []
+        item_start = 0 if self._item_parts is not None else None
+        key_start = 0 if self._key_parts is not None else None
+        pos = 0
+        while True:
+            if self._in_string:
+                if self._escape:
+                    if pos >= len(chunk):
+                        break
+                    self._escape = False
+                    pos += 1
+                    continue
+                match = _STRING_SPECIAL.search(chunk, pos)
+                if match is None:
+                    break
+                pos = match.end()
+                if match.group() == '\\':
+                    self._escape = True
+                    continue
+                self._in_string = False
+                if key_start is not None:
+                    self._key_parts.append(chunk[key_start:pos - 1])
+                    self._last_key = "".join(self._key_parts)
+                    self._key_parts = None
+                    key_start = None
+                continue
+
+            match = _SPECIAL.search(chunk, pos)
+            if match is None:
+                break
+            char = match.group()
+            pos = match.end()
+            if char == '"':
+                self._in_string = True
+                if len(self._stack) == 1:
+                    # Strings directly inside the top-level object are keys (or short values)
+                    self._key_parts = []
+                    key_start = pos
+            elif char in '{[':
+                if char == '[' and len(self._stack) == 1 and self._last_key == self.array_key:
+                    self._items_depth = len(self._stack) + 1
+                self._stack.append(char)
+                if char == '{' and self._items_depth is not None and len(self._stack) == self._items_depth + 1:
+                    self._item_parts = []
+                    item_start = pos - 1
+            elif char in '}]':
+                if self._stack:
+                    self._stack.pop()
+                if char == '}' and self._item_parts is not None and len(self._stack) == self._items_depth:
+                    self._item_parts.append(chunk[item_start:pos])
+                    items.append(json.loads("".join(self._item_parts)))
+                    self._item_parts = None
+                    item_start = None
+                elif char == ']' and self._items_depth is not None and len(self._stack) == self._items_depth - 1:
+                    self._items_depth = None
+
+        if item_start is not None:
+            self._item_parts.append(chunk[item_start:])
+        if key_start is not None:
+            self._key_parts.append(chunk[key_start:])
+        self.count += len(items)
+        return items
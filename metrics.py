@@ -0,0 +1,341 @@
+"""
+Hot-path instrumentation.
+
+A small, dependency-free metrics registry rendered in the Prometheus text
+format on ``/metrics``. Stage timings are recorded both in process-wide
+histograms and in a per-request trace, so the CLI can print a timing summary
+for the document it just processed.
+
+Traces live in a context variable. Code that hands work to other threads
+should submit it through ``contextvars.copy_context().run`` (or call
+``use_trace()``) so the worker records into the caller's trace.
+"""
+import bisect
+import contextvars
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+TOKEN_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 20000, 40000, 65535, 131072)
+BYTES_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 8 * 1024 ** 2, 16 * 1024 ** 2)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative histogram with optional labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in sorted(values.items())]
+
+
+class CallbackGauge:
+    """Gauge whose values are read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, callback, label):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.label = label
+
+    def render(self):
+        lines = []
+        for key, value in sorted(self.callback().items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"{self.name}{_format_labels(((self.label, key),))} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    """Holds metrics and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "extract_stage_seconds", "Time spent in each stage of an extraction request.", SECONDS_BUCKETS))
+MODEL_TOKENS = REGISTRY.register(Histogram(
+    "extract_model_tokens", "Tokens per model call by kind (input, output, thinking).", TOKEN_BUCKETS))
+LINE_ITEMS = REGISTRY.register(Histogram(
+    "extract_line_items", "Line items extracted per document.", COUNT_BUCKETS))
+DOCUMENT_BYTES = REGISTRY.register(Histogram(
+    "extract_document_bytes", "Size of submitted documents in bytes.", BYTES_BUCKETS))
+DOCUMENT_PAGES = REGISTRY.register(Histogram(
+    "extract_document_pages", "Page count of submitted PDFs.", COUNT_BUCKETS))
+REQUESTS = REGISTRY.register(Counter(
+    "extract_requests_total", "Extraction requests by endpoint and HTTP status."))
+PREFLIGHT_PAGES_DROPPED = REGISTRY.register(Counter(
+    "extract_preflight_pages_dropped_total", "Pages removed before the model call, by reason."))
+PREFLIGHT_BYTES_SAVED = REGISTRY.register(Histogram(
+    "extract_preflight_bytes_saved", "Bytes removed from a document by preflight.", BYTES_BUCKETS))
+TEXT_LAYER_DOCUMENTS = REGISTRY.register(Counter(
+    "extract_text_layer_documents_total", "PDFs checked for a text layer, by outcome (resolved or fallback)."))
+
+ROUTING_DECISIONS = REGISTRY.register(Counter(
+    "extract_routing_decisions_total", "Model calls by the tier routing chose and why."))
+ROUTING_ESCALATIONS = REGISTRY.register(Counter(
+    "extract_routing_escalations_total", "Light tier results that failed validation, by reason."))
+ROUTING_SECONDS = REGISTRY.register(Histogram(
+    "extract_routing_seconds", "Model call time by final tier (light, heavy or escalated).", SECONDS_BUCKETS))
+
+_trace = contextvars.ContextVar("extract_trace", default=None)
+
+
+def current_trace():
+    """Returns the trace dict of the current request, or None."""
+    return _trace.get()
+
+
+@contextmanager
+def trace():
+    """
+    Collects stage timings and document facts for one request.
+
+    Yields:
+        dict: ``{"stages": {stage: seconds}, ...}``, filled in as the request runs.
+    """
+    data = {"stages": {}}
+    token = _trace.set(data)
+    try:
+        yield data
+    finally:
+        _trace.reset(token)
+
+
+@contextmanager
+def use_trace(data):
+    """Records into ``data`` (a trace from another thread) within this block."""
+    token = _trace.set(data)
+    try:
+        yield
+    finally:
+        _trace.reset(token)
+
+
+def record_stage(stage, seconds):
+    """Records a stage duration in the histogram and the current trace."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    data = _trace.get()
+    if data is not None:
+        stages = data["stages"]
+        stages[stage] = round(stages.get(stage, 0.0) + seconds, 4)
+
+
+@contextmanager
+def timed(stage):
+    """Times the enclosed block as ``stage``."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def record(name, value):
+    """Stores a document fact (size, pages, line items, ...) on the current trace."""
+    data = _trace.get()
+    if data is not None:
+        data[name] = value
+
+
+def record_document(size, pages=None):
+    DOCUMENT_BYTES.observe(size)
+    record("document_bytes", size)
+    if pages is not None:
+        DOCUMENT_PAGES.observe(pages)
+        record("document_pages", pages)
+
+
+def record_line_items(count):
+    LINE_ITEMS.observe(count)
+    record("line_items", count)
+
+
+def record_preflight(report):
+    """Records the savings of one preflight run (see ``preflight.py``)."""
+    PREFLIGHT_PAGES_DROPPED.inc(len(report["blank_pages"]), reason="blank")
+    PREFLIGHT_PAGES_DROPPED.inc(len(report["duplicate_pages"]), reason="duplicate")
+    PREFLIGHT_BYTES_SAVED.observe(max(0, report["bytes_saved"]))
+    record("preflight", report)
+
+
+def record_text_layer(stats):
+    """Records whether a PDF was resolved from its text layer; ``stats`` is None on fallback."""
+    TEXT_LAYER_DOCUMENTS.inc(outcome="resolved" if stats is not None else "fallback")
+    if stats is not None:
+        record("text_layer", stats)
+
+
+def record_routing(decision):
+    """
+    Records one routing decision (see ``routing.py``).
+
+    Decisions are appended to the trace's ``routing`` list, since a chunked
+    document makes one model call per page range.
+    """
+    ROUTING_DECISIONS.inc(tier=decision["tier"], reason=decision["reason"])
+    if decision.get("escalated"):
+        ROUTING_ESCALATIONS.inc(reason=decision["escalated"])
+    ROUTING_SECONDS.observe(decision["seconds"], tier="escalated" if decision.get("escalated") else decision["tier"])
+    data = _trace.get()
+    if data is not None:
+        data.setdefault("routing", []).append(decision)
+
+
+def record_usage(usage):
+    """
+    Records token counts from a response's ``usage_metadata``.
+
+    Args:
+        usage: ``GenerateContentResponseUsageMetadata`` or None.
+    """
+    if usage is None:
+        return
+    data = _trace.get()
+    for kind, attr in (("input", "prompt_token_count"), ("output", "candidates_token_count"), ("thinking", "thoughts_token_count")):
+        value = getattr(usage, attr, None)
+        if value is None:
+            continue
+        MODEL_TOKENS.observe(value, kind=kind)
+        if data is not None:
+            tokens = data.setdefault("tokens", {})
+            tokens[kind] = tokens.get(kind, 0) + value
+
+
+class StreamTimer:
+    """Records time to first chunk, total stream time and token usage of one model call."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_chunk = False
+        self.usage = None
+
+    def chunk(self, usage=None):
+        if not self.first_chunk:
+            self.first_chunk = True
+            record_stage("model_first_chunk", time.perf_counter() - self.started)
+        # Usage is cumulative; the last chunk carrying it has the final counts
+        if usage is not None:
+            self.usage = usage
+
+    def finish(self):
+        record_stage("model_stream", time.perf_counter() - self.started)
+        record_usage(self.usage)
+
+
+def process_stats():
+    """
+    Returns CPU time and peak memory of this process.
+
+    Returns:
+        dict: ``cpu_seconds`` (user + system) and ``max_rss_bytes``; empty
+        where the ``resource`` module is unavailable.
+    """
+    if resource is None:
+        return {}
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "cpu_seconds": round(usage.ru_utime + usage.ru_stime, 3),
+        "max_rss_bytes": usage.ru_maxrss * scale,
+    }
+
+
+def register_stats(name, help, callback, label="counter"):
+    """Exposes a ``stats()``-style dict of numbers as a gauge on ``/metrics``."""
+    REGISTRY.register(CallbackGauge(name, help, callback, label))
+
+
+def render():
+    """Returns all metrics in the Prometheus text exposition format."""
+    return REGISTRY.render()
+
+
+register_stats("extract_process", "CPU seconds and peak resident memory of this process.", process_stats, label="resource")
@@ -0,0 +1,281 @@
+"""
+PDF preflight: shrink a document before it is sent to the model.
+
+Scanned bills often contain blank separator pages, repeated pages and
+600 dpi scans, all of which cost input tokens and latency without adding
+line items. ``preflight()`` drops blank and duplicate pages and can
+downsample oversized embedded images to a target resolution. It returns a
+page map from the pages of the reduced document back to the original, so
+page indices reported to clients keep referring to the uploaded file.
+
+Needs ``pypdf``. Detecting blank *scanned* pages and downsampling images
+also need ``Pillow``; without it only pages with no visible content are
+treated as blank and images are left alone.
+"""
+import hashlib
+import io
+import re
+
+from async_engine import TOKENS_PER_PAGE
+from documents import open_pdf
+
+try:
+    import pypdf
+except ImportError:  # pragma: no cover - optional dependency
+    pypdf = None
+
+try:
+    from PIL import Image, ImageStat
+except ImportError:  # pragma: no cover - optional dependency
+    Image = ImageStat = None
+
+
+def available():
+    """Whether ``pypdf`` is installed."""
+    return pypdf is not None
+
+
+# Content stream operators that put something on the page
+_PAINT_OPERATORS = re.compile(rb"(?<![A-Za-z])(?:Tj|TJ|'|\"|Do|f\*?|F|S|s|B\*?|b\*?|sh|BI)(?![A-Za-z*])")
+
+# A scanned page is blank when it is almost uniformly light
+BLANK_MIN_MEAN = 245
+BLANK_MAX_STDDEV = 4
+
+# Downsample only when an image exceeds the target by more than this factor
+_DPI_SLACK = 1.1
+
+
+def _xobjects(page):
+    resources = page.get("/Resources")
+    if resources is None:
+        return {}
+    xobjects = resources.get_object().get("/XObject")
+    return xobjects.get_object() if xobjects is not None else {}
+
+
+def _images(page):
+    """Image XObjects drawn directly by the page."""
+    images = []
+    for name, ref in _xobjects(page).items():
+        xobject = ref.get_object()
+        if xobject.get("/Subtype") == "/Image":
+            images.append((name, xobject))
+    return images
+
+
+def _stream_bytes(stream):
+    try:
+        return stream.get_data()
+    except Exception:
+        # Undecodable filters: the encoded bytes identify the stream just as well
+        return getattr(stream, "_data", b"") or b""
+
+
+def _object_digest(obj, memo):
+    """
+    Hash of a PDF object with every reference resolved.
+
+    Indirect objects are hashed once per document and memoised in ``memo``;
+    a reference back into an object still being hashed counts as a cycle.
+    ``/Parent`` links are skipped so a page does not pull in the page tree.
+    """
+    if isinstance(obj, pypdf.generic.IndirectObject):
+        key = (obj.idnum, obj.generation)
+        if key not in memo:
+            memo[key] = b"cycle"
+            memo[key] = _object_digest(obj.get_object(), memo)
+        return memo[key]
+    h = hashlib.sha256(type(obj).__name__.encode("utf-8"))
+    if isinstance(obj, pypdf.generic.DictionaryObject):
+        for key in sorted(obj):
+            if key == "/Parent":
+                continue
+            h.update(key.encode("utf-8"))
+            h.update(_object_digest(obj.raw_get(key), memo))
+        if isinstance(obj, pypdf.generic.StreamObject):
+            h.update(_stream_bytes(obj))
+    elif isinstance(obj, pypdf.generic.ArrayObject):
+        for item in obj:
+            h.update(_object_digest(item, memo))
+    else:
+        h.update(repr(obj).encode("utf-8"))
+    return h.digest()
+
+
+def page_digest(page, memo=None):
+    """
+    Hash of everything that determines how a page looks.
+
+    Covers the content stream and the resolved ``/Resources`` tree, so form
+    XObjects, the images they draw and the page's fonts all count. Two pages
+    share a digest only when their object graphs are identical.
+    """
+    memo = {} if memo is None else memo
+    h = hashlib.sha256()
+    contents = page.get_contents()
+    if contents is not None:
+        h.update(_stream_bytes(contents))
+    resources = page.get("/Resources")
+    if resources is not None:
+        h.update(_object_digest(page.raw_get("/Resources"), memo))
+    h.update(repr([float(v) for v in page.mediabox]).encode("utf-8"))
+    h.update(str(page.rotation or 0).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _image_is_blank(page):
+    for image_file in page.images:
+        stat = ImageStat.Stat(image_file.image.convert("L"))
+        if stat.mean[0] < BLANK_MIN_MEAN or stat.stddev[0] > BLANK_MAX_STDDEV:
+            return False
+    return True
+
+
+def is_blank(page):
+    """
+    Whether a page shows nothing worth extracting.
+
+    Pages without painting operators are blank. Pages that only paint
+    images (scans) are blank when every image is almost uniformly white,
+    which needs Pillow to decide.
+    """
+    contents = page.get_contents()
+    data = _stream_bytes(contents) if contents is not None else b""
+    operators = set(_PAINT_OPERATORS.findall(data))
+    if not operators:
+        return True
+    if page.extract_text().strip():
+        return False
+    if operators != {b"Do"} or Image is None:
+        return False
+    # Form XObjects can hold arbitrary content, so only decide for plain images
+    if len(_images(page)) != len(_xobjects(page)):
+        return False
+    try:
+        return _image_is_blank(page)
+    except Exception:
+        return False
+
+
+def image_dpi(page, xobject):
+    """Effective resolution of an image, assuming it spans the page."""
+    width_in = float(page.mediabox.width) / 72
+    height_in = float(page.mediabox.height) / 72
+    if (page.rotation or 0) % 180:
+        width_in, height_in = height_in, width_in
+    pixels_w = int(xobject.get("/Width", 0))
+    pixels_h = int(xobject.get("/Height", 0))
+    if not width_in or not height_in:
+        return 0.0
+    return max(pixels_w / width_in, pixels_h / height_in)
+
+
+def downsample_images(page, target_dpi):
+    """
+    Resamples images above ``target_dpi`` in place.
+
+    Returns:
+        int: Number of images replaced.
+    """
+    oversized = {}
+    for name, xobject in _images(page):
+        dpi = image_dpi(page, xobject)
+        if dpi > target_dpi * _DPI_SLACK:
+            oversized[name.lstrip("/")] = dpi
+    if not oversized:
+        return 0
+    replaced = 0
+    for image_file in page.images:
+        dpi = oversized.get(image_file.name.rsplit(".", 1)[0].lstrip("/"))
+        if dpi is None:
+            continue
+        image = image_file.image
+        scale = target_dpi / dpi
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image_file.replace(image.resize(size, Image.LANCZOS), quality=80)
+        replaced += 1
+    return replaced
+
+
+def preflight(pdf_bytes, drop_blank=True, drop_duplicates=True, target_dpi=0):
+    """
+    Reduces a PDF before extraction.
+
+    Args:
+        pdf_bytes (bytes): The raw PDF contents.
+        drop_blank (bool): Skip pages with no visible content.
+        drop_duplicates (bool): Skip pages whose content and resources are
+            identical to an earlier page.
+        target_dpi (int): Downsample images above this resolution; 0 keeps
+            them as they are. Needs Pillow.
+    Returns:
+        tuple: ``(pdf_bytes, page_map, report)``. ``page_map[i]`` is the
+        0-based index in the original document of page ``i`` of the returned
+        PDF. The original bytes are returned unchanged when nothing could be
+        saved.
+    """
+    reader = open_pdf(pdf_bytes)
+    total = len(reader.pages)
+    kept = []
+    blank = []
+    duplicate = []
+    seen = set()
+    memo = {}
+    for index, page in enumerate(reader.pages):
+        if drop_blank and is_blank(page):
+            blank.append(index)
+            continue
+        if drop_duplicates:
+            digest = page_digest(page, memo)
+            if digest in seen:
+                duplicate.append(index)
+                continue
+            seen.add(digest)
+        kept.append(index)
+    if not kept and total:
+        # Never send an empty document; the model reports no line items instead
+        kept = [0]
+        blank = [i for i in blank if i != 0]
+        duplicate = [i for i in duplicate if i != 0]
+
+    resample = bool(target_dpi) and Image is not None
+    images_resampled = 0
+    output = pdf_bytes
+    if len(kept) < total or resample:
+        writer = pypdf.PdfWriter()
+        for index in kept:
+            writer.add_page(reader.pages[index])
+        if resample:
+            for page in writer.pages:
+                images_resampled += downsample_images(page, target_dpi)
+        if len(kept) < total or images_resampled:
+            buffer = io.BytesIO()
+            writer.write(buffer)
+            output = buffer.getvalue()
+            # Rewriting can grow a document that had nothing to drop
+            if len(output) >= len(pdf_bytes) and len(kept) == total:
+                output = pdf_bytes
+                images_resampled = 0
+
+    report = {
+        'pages': total,
+        'pages_sent': len(kept),
+        'blank_pages': blank,
+        'duplicate_pages': duplicate,
+        'images_resampled': images_resampled,
+        'bytes_before': len(pdf_bytes),
+        'bytes_after': len(output),
+        'bytes_saved': len(pdf_bytes) - len(output),
+        'input_tokens_saved': (total - len(kept)) * TOKENS_PER_PAGE,
+    }
+    return output, kept, report
+
+
+def remap_pages(items, page_map):
+    """Rewrites ``pageIndex`` of each item from the reduced document to the original."""
+    for item in items:
+        index = item.get("pageIndex")
+        if isinstance(index, int) and 0 <= index < len(page_map):
+            item["pageIndex"] = page_map[index]
+    return items
@@ -0,0 +1,237 @@
+"""
+Replaying fake model backend for offline benchmarks and load tests.
+
+A recording captures one ``generate_content_stream`` call: the text chunks in
+order, the time to the first chunk, the gaps between chunks and the token
+usage reported on the final chunk. ``ReplayExtractor`` plays recordings back
+with the same pacing (or with fixed delays) and can inject errors, so the
+request path can be exercised at realistic latencies without Vertex quota.
+
+Recording files are JSON::
+
+    {"variant": "full", "ttft_s": 4.1, "chunk_delays_s": [0.2, ...],
+     "chunks": ["{\\"line_details1\\": [", ...], "usage": {"prompt_token_count": 1290, ...}}
+
+A plain response JSON file (such as a ``STUB_RESPONSE_FILE``) is accepted too
+and is split into evenly sized chunks.
+"""
+import asyncio
+import glob
+import json
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+import metrics
+from extractor import Extractor, schema_fingerprint
+
+# Chunk size used when a plain response is replayed
+DEFAULT_CHUNK_CHARS = 512
+
+
+class ReplayError(Exception):
+    """Injected model error; carries an HTTP status like ``google.genai`` errors."""
+
+    def __init__(self, code, message="Injected replay error"):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+def split_text(text, chunk_chars=DEFAULT_CHUNK_CHARS):
+    """Splits a response into ``chunk_chars``-sized pieces."""
+    return [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)] or [""]
+
+
+def load_recording(path):
+    """
+    Reads a recording, or turns a plain response JSON file into one.
+
+    Args:
+        path (str): Path to the JSON file.
+    Returns:
+        dict: Recording with at least ``variant`` and ``chunks``.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    data = json.loads(text)
+    if isinstance(data, dict) and isinstance(data.get("chunks"), list):
+        data.setdefault("variant", "full")
+        return data
+    variant = "compact" if isinstance(data, dict) and "rows" in data else "full"
+    return {"variant": variant, "chunks": split_text(text)}
+
+
+def load_recordings(source):
+    """
+    Loads recordings from a file or from every ``*.json`` file in a directory.
+
+    Returns:
+        list: Recordings in file name order.
+    """
+    if os.path.isdir(source):
+        paths = sorted(glob.glob(os.path.join(source, "*.json")))
+    else:
+        paths = [source]
+    recordings = [load_recording(path) for path in paths]
+    if not recordings:
+        raise ValueError(f"No recordings found in {source}")
+    return recordings
+
+
+def record_stream(extractor, file_bytes, mime_type, variant="full"):
+    """
+    Captures one real streaming call of a ``GeminiExtractor`` as a recording.
+
+    Args:
+        extractor (GeminiExtractor): Bare backend to record from.
+        file_bytes (bytes): The raw document contents.
+        mime_type (str): The MIME type of the document.
+        variant (str): Name of the prompt and schema pair to use.
+    Returns:
+        dict: The recording, ready to be written as JSON.
+    """
+    chunks = []
+    delays = []
+    usage = None
+    ttft = None
+    started = last = time.perf_counter()
+    for chunk in extractor.client.models.generate_content_stream(
+        model=extractor.model,
+        contents=extractor.build_contents(file_bytes, mime_type, variant),
+        config=extractor.configs[variant],
+    ):
+        now = time.perf_counter()
+        if chunk.usage_metadata is not None:
+            usage = chunk.usage_metadata
+        if not chunk.text:
+            continue
+        if ttft is None:
+            ttft = now - started
+        else:
+            delays.append(round(now - last, 4))
+        last = now
+        chunks.append(chunk.text)
+    usage_fields = ("prompt_token_count", "candidates_token_count", "thoughts_token_count")
+    return {
+        "model": extractor.model,
+        "variant": variant,
+        "ttft_s": round(ttft or 0.0, 4),
+        "chunk_delays_s": delays,
+        "chunks": chunks,
+        "usage": {name: getattr(usage, name, None) for name in usage_fields} if usage is not None else None,
+    }
+
+
+class ReplayExtractor(Extractor):
+    """
+    Plays back recorded model streams.
+
+    Args:
+        recordings (list): Recordings from ``load_recordings()``. Calls for a
+            variant cycle through the recordings of that variant, falling back
+            to all recordings when none match.
+        ttft (float): Seconds before the first chunk; None to use the recorded value.
+        chunk_delay (float): Seconds between chunks; None to use the recorded gaps.
+        error_rate (float): Probability that a call fails before its first chunk.
+        error_status (int): HTTP status of injected errors, e.g. 429 or 503.
+        truncate_rate (float): Probability that a call stops halfway through,
+            leaving invalid JSON.
+        seed (int): Seed for error injection, for reproducible runs.
+        model (str): Model name reported for fingerprints and metrics.
+    """
+
+    def __init__(self, recordings, ttft=None, chunk_delay=None, error_rate=0.0, error_status=503,
+                 truncate_rate=0.0, seed=None, model="replay"):
+        self.recordings = recordings
+        self.ttft = ttft
+        self.chunk_delay = chunk_delay
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.truncate_rate = truncate_rate
+        self.model = model
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._calls = 0
+        self.counters = {'calls': 0, 'errors': 0, 'truncated': 0}
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Builds a replay backend from ``load_config()`` style settings."""
+        return cls(
+            load_recordings(settings['replay_source']),
+            ttft=settings.get('replay_ttft'),
+            chunk_delay=settings.get('replay_chunk_delay'),
+            error_rate=settings.get('replay_error_rate', 0.0),
+            error_status=settings.get('replay_error_status', 503),
+            truncate_rate=settings.get('replay_truncate_rate', 0.0),
+            seed=settings.get('replay_seed'),
+        )
+
+    def fingerprint(self, variant="full"):
+        texts = "".join("".join(recording["chunks"]) for recording in self.recordings)
+        return schema_fingerprint(self.model, texts, {"variant": variant})
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def _plan(self, variant):
+        """Picks the recording, delays and injected fault for one call."""
+        matching = [r for r in self.recordings if r["variant"] == variant] or self.recordings
+        with self._lock:
+            recording = matching[self._calls % len(matching)]
+            self._calls += 1
+            self.counters['calls'] += 1
+            fail = self._random.random() < self.error_rate
+            truncate = not fail and self._random.random() < self.truncate_rate
+            if fail:
+                self.counters['errors'] += 1
+            if truncate:
+                self.counters['truncated'] += 1
+
+        chunks = recording["chunks"]
+        if truncate:
+            chunks = split_text("".join(chunks))
+            chunks = chunks[:max(1, len(chunks) // 2)]
+            if len(chunks[-1]) > 1:
+                chunks[-1] = chunks[-1][:len(chunks[-1]) // 2]
+        ttft = self.ttft if self.ttft is not None else recording.get("ttft_s", 0.0)
+        recorded = recording.get("chunk_delays_s") or []
+        delays = [ttft]
+        for i in range(1, len(chunks)):
+            if self.chunk_delay is not None:
+                delays.append(self.chunk_delay)
+            else:
+                delays.append(recorded[i - 1] if i - 1 < len(recorded) else 0.0)
+        usage = SimpleNamespace(**recording["usage"]) if recording.get("usage") else None
+        return chunks, delays, usage, fail
+
+    def stream(self, file_bytes, mime_type, variant="full"):
+        chunks, delays, usage, fail = self._plan(variant)
+        timer = metrics.StreamTimer()
+        try:
+            if fail:
+                time.sleep(delays[0])
+                raise ReplayError(self.error_status)
+            for i, (chunk, delay) in enumerate(zip(chunks, delays)):
+                time.sleep(delay)
+                timer.chunk(usage if i == len(chunks) - 1 else None)
+                yield chunk
+        finally:
+            timer.finish()
+
+    async def astream(self, file_bytes, mime_type, variant="full"):
+        chunks, delays, usage, fail = self._plan(variant)
+        timer = metrics.StreamTimer()
+        try:
+            if fail:
+                await asyncio.sleep(delays[0])
+                raise ReplayError(self.error_status)
+            for i, (chunk, delay) in enumerate(zip(chunks, delays)):
+                await asyncio.sleep(delay)
+                timer.chunk(usage if i == len(chunks) - 1 else None)
+                yield chunk
+        finally:
+            timer.finish()
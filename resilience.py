@@ -0,0 +1,438 @@
+"""
+Tail-latency control around model calls.
+
+``ResilientExtractor`` wraps another extractor and adds:
+
+* a per-request deadline,
+* retries with exponential backoff and full jitter, only for retryable errors
+  (408/429/5xx, connection failures, timeouts and invalid JSON responses),
+* optional hedging: if an attempt has not finished after a delay (a fixed
+  number of seconds or the observed p95 latency), a duplicate request is
+  started. The first complete, valid JSON response wins and the other attempt
+  is cancelled.
+
+Retry and hedge counts are kept so the cost of these settings can be tuned.
+"""
+import asyncio
+import contextvars
+import json
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from contextlib import contextmanager
+
+from extractor import Extractor, error_status
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+try:
+    import httpx
+    _TRANSPORT_ERRORS = (ConnectionError, TimeoutError, httpx.TransportError)
+except ImportError:  # pragma: no cover - httpx ships with google-genai
+    _TRANSPORT_ERRORS = (ConnectionError, TimeoutError)
+
+
+# Set while an ``AsyncEngine`` runs a call: awaited before every attempt so
+# retries and hedges are admitted against the quota too
+_quota_gate = contextvars.ContextVar("quota_gate", default=None)
+
+
+@contextmanager
+def quota_gate(admit):
+    """
+    Admits the async attempts made within this block through ``admit``.
+
+    ``admit`` is a coroutine function awaited before each attempt. Streamed
+    attempts run on worker threads and submit it to the event loop this
+    block was entered on. While a gate is set, 429 responses are not retried
+    locally; they are left to the caller that owns the quota.
+    """
+    token = _quota_gate.set((admit, asyncio.get_running_loop()))
+    try:
+        yield
+    finally:
+        _quota_gate.reset(token)
+
+
+# Absolute deadline shared by every call made within a ``deadline_scope()``
+_scope_deadline = contextvars.ContextVar("scope_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(seconds):
+    """
+    Bounds all calls made within this block by one deadline.
+
+    Each ``ResilientExtractor`` call ends at its own deadline or the scope's,
+    whichever comes first, so several calls (e.g. a routing escalation) share
+    one budget. Nested scopes can only shorten it.
+
+    Args:
+        seconds (float): Budget from now; 0 leaves the deadline unchanged.
+    """
+    deadline_at = _scope_deadline.get()
+    if seconds:
+        ends = time.monotonic() + seconds
+        deadline_at = ends if deadline_at is None else min(deadline_at, ends)
+    token = _scope_deadline.set(deadline_at)
+    try:
+        yield
+    finally:
+        _scope_deadline.reset(token)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a request does not finish within its deadline."""
+
+
+class InvalidResponse(ValueError):
+    """Raised when the model returns text that is not valid JSON."""
+
+
+class _Cancelled(Exception):
+    """Internal: an attempt was abandoned because another one won."""
+
+
+def is_retryable(exc):
+    """Whether a failed attempt is worth repeating."""
+    if isinstance(exc, InvalidResponse):
+        return True
+    if isinstance(exc, DeadlineExceeded):
+        return False
+    if error_status(exc) in RETRYABLE_STATUS:
+        return True
+    return isinstance(exc, _TRANSPORT_ERRORS)
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """Exponential backoff with full jitter for the given retry number (1-based)."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+def _validate(result_text):
+    try:
+        json.loads(result_text)
+    except ValueError as e:
+        raise InvalidResponse(f"Model returned invalid JSON: {e}") from e
+    return result_text
+
+
+class ResilientExtractor(Extractor):
+    """
+    Adds deadlines, retries and hedged requests to another extractor.
+
+    Args:
+        inner (Extractor): The backend doing the actual model calls.
+        deadline (float): Seconds a request may take in total; 0 for none.
+        max_attempts (int): Attempts per request, including the first.
+        base_delay (float): Backoff before the first retry, doubled each time.
+        max_delay (float): Upper bound for a single backoff.
+        hedge_after (float | str): Seconds before a hedged duplicate is sent,
+            ``"p95"`` to use the observed 95th percentile latency, or None to
+            disable hedging.
+        hedge_min_samples (int): Latencies needed before ``"p95"`` hedging starts.
+        retry_invalid (bool): Retry responses that are not valid JSON. Turn
+            off when they are expected to fail the same way again, e.g. when
+            the output limit truncates them.
+    """
+
+    def __init__(self, inner, deadline=0, max_attempts=3, base_delay=1.0, max_delay=30.0,
+                 hedge_after=None, hedge_min_samples=20, retry_invalid=True):
+        self.inner = inner
+        self.model = inner.model
+        self.deadline = deadline
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_after = hedge_after
+        self.hedge_min_samples = hedge_min_samples
+        self.retry_invalid = retry_invalid
+        self._latencies = deque(maxlen=500)
+        self._lock = threading.Lock()
+        self.counters = {
+            'requests': 0,
+            'attempts': 0,
+            'retries': 0,
+            'hedges': 0,
+            'hedge_wins': 0,
+            'deadline_exceeded': 0,
+        }
+
+    def fingerprint(self, variant="full"):
+        return self.inner.fingerprint(variant)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None when hedging is off."""
+        if self.hedge_after in (None, "", 0):
+            return None
+        if self.hedge_after != "p95":
+            return float(self.hedge_after)
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        delay = self.hedge_delay()
+        stats['hedge_delay_s'] = round(delay, 3) if delay is not None else None
+        return stats
+
+    def _deadline_at(self):
+        own = time.monotonic() + self.deadline if self.deadline else None
+        scope = _scope_deadline.get()
+        if own is None or scope is None:
+            return own if scope is None else scope
+        return min(own, scope)
+
+    def _remaining(self, deadline_at):
+        if deadline_at is None:
+            return None
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            self._count('deadline_exceeded')
+            raise DeadlineExceeded("Model call exceeded its deadline")
+        return remaining
+
+    def _retry_wait(self, attempt, error, deadline_at):
+        """Returns the backoff before retry ``attempt``, or re-raises ``error``."""
+        if attempt >= self.max_attempts or not is_retryable(error):
+            raise error
+        if _quota_gate.get() is not None and error_status(error) == 429:
+            raise error
+        if isinstance(error, InvalidResponse) and not self.retry_invalid:
+            raise error
+        delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+        if deadline_at is not None and time.monotonic() + delay >= deadline_at:
+            raise error
+        self._count('retries')
+        return delay
+
+    # Sync path
+
+    def _attempt(self, file_bytes, mime_type, variant, cancel):
+        self._count('attempts')
+        started = time.monotonic()
+        parts = []
+        stream = self.inner.stream(file_bytes, mime_type, variant)
+        try:
+            for chunk in stream:
+                if cancel.is_set():
+                    raise _Cancelled()
+                parts.append(chunk)
+        finally:
+            # Closing the generator releases the underlying HTTP stream
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+        result_text = _validate("".join(parts))
+        with self._lock:
+            self._latencies.append(time.monotonic() - started)
+        return result_text
+
+    def _submit(self, file_bytes, mime_type, variant, cancel):
+        # One thread per attempt: a shared pool would cap concurrent model calls
+        # process-wide and let queued attempts spend their deadline waiting.
+        # The attempt runs in a copy of the caller's context so it records into its trace.
+        future = Future()
+        context = contextvars.copy_context()
+
+        def run():
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(context.run(self._attempt, file_bytes, mime_type, variant, cancel))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name="attempt", daemon=True).start()
+        return future
+
+    def _hedged(self, file_bytes, mime_type, variant, deadline_at):
+        hedge_delay = self.hedge_delay()
+        if hedge_delay is None and deadline_at is None:
+            # Nothing to race against, so run in the caller's thread
+            return self._attempt(file_bytes, mime_type, variant, threading.Event())
+
+        cancel = threading.Event()
+        pending = {self._submit(file_bytes, mime_type, variant, cancel)}
+        hedge = None
+        last_error = None
+        try:
+            while pending:
+                remaining = self._remaining(deadline_at)
+                # Only hedge if the duplicate still has time to finish
+                can_hedge = hedge is None and hedge_delay is not None and (remaining is None or hedge_delay < remaining)
+                timeout = hedge_delay if can_hedge else remaining
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    if can_hedge:
+                        self._count('hedges')
+                        hedge = self._submit(file_bytes, mime_type, variant, cancel)
+                        pending.add(hedge)
+                    continue
+                for future in done:
+                    try:
+                        result_text = future.result()
+                    except Exception as e:
+                        last_error = e
+                        continue
+                    if future is hedge:
+                        self._count('hedge_wins')
+                    return result_text
+            raise last_error
+        finally:
+            # Tells the losing attempt to stop reading its stream
+            cancel.set()
+
+    def _stream_attempt(self, file_bytes, mime_type, variant, deadline_at):
+        """
+        Yields the chunks of one streamed attempt within the deadline.
+
+        The attempt reads the model stream on its own thread, so a backend
+        that stalls before (or between) chunks cannot outlive the deadline.
+        """
+        if deadline_at is None:
+            yield from self.inner.stream(file_bytes, mime_type, variant)
+            return
+
+        chunks = queue.Queue()
+        cancel = threading.Event()
+        context = contextvars.copy_context()
+
+        def run():
+            stream = self.inner.stream(file_bytes, mime_type, variant)
+            try:
+                for chunk in stream:
+                    if cancel.is_set():
+                        break
+                    chunks.put((chunk, None))
+            except BaseException as e:
+                chunks.put((None, e))
+                return
+            finally:
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    close()
+            chunks.put((None, None))
+
+        threading.Thread(target=context.run, args=(run,), name="attempt", daemon=True).start()
+        try:
+            while True:
+                try:
+                    chunk, error = chunks.get(timeout=self._remaining(deadline_at))
+                except queue.Empty:
+                    continue
+                if error is not None:
+                    raise error
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            # Tells an abandoned attempt to stop reading its stream
+            cancel.set()
+
+    def stream(self, file_bytes, mime_type, variant="full"):
+        """
+        Streams with retries for failures that happen before the first chunk.
+
+        Once text has been handed to the caller the stream cannot be replayed,
+        so later errors are raised as-is. Hedging does not apply to streams.
+        """
+        deadline_at = self._deadline_at()
+        self._count('requests')
+        attempt = 0
+        while True:
+            attempt += 1
+            gate = _quota_gate.get()
+            if gate is not None:
+                admit, loop = gate
+                asyncio.run_coroutine_threadsafe(admit(), loop).result()
+            self._count('attempts')
+            started = False
+            try:
+                for chunk in self._stream_attempt(file_bytes, mime_type, variant, deadline_at):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started:
+                    raise
+                time.sleep(self._retry_wait(attempt, e, deadline_at))
+
+    def generate(self, file_bytes, mime_type, variant="full"):
+        deadline_at = self._deadline_at()
+        self._count('requests')
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return self._hedged(file_bytes, mime_type, variant, deadline_at)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                time.sleep(self._retry_wait(attempt, e, deadline_at))
+
+    # Async path
+
+    async def _aattempt(self, file_bytes, mime_type, variant):
+        gate = _quota_gate.get()
+        if gate is not None:
+            await gate[0]()
+        self._count('attempts')
+        started = time.monotonic()
+        result_text = _validate(await self.inner.agenerate(file_bytes, mime_type, variant))
+        with self._lock:
+            self._latencies.append(time.monotonic() - started)
+        return result_text
+
+    async def _ahedged(self, file_bytes, mime_type, variant, deadline_at):
+        hedge_delay = self.hedge_delay()
+        tasks = {asyncio.ensure_future(self._aattempt(file_bytes, mime_type, variant))}
+        primary = next(iter(tasks))
+        hedged = False
+        last_error = None
+        try:
+            while tasks:
+                remaining = self._remaining(deadline_at)
+                can_hedge = not hedged and hedge_delay is not None and (remaining is None or hedge_delay < remaining)
+                timeout = hedge_delay if can_hedge else remaining
+                done, tasks = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if can_hedge:
+                        hedged = True
+                        self._count('hedges')
+                        tasks.add(asyncio.ensure_future(self._aattempt(file_bytes, mime_type, variant)))
+                    continue
+                for task in done:
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        continue
+                    if task is not primary:
+                        self._count('hedge_wins')
+                    return task.result()
+            raise last_error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def agenerate(self, file_bytes, mime_type, variant="full"):
+        deadline_at = self._deadline_at()
+        self._count('requests')
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await self._ahedged(file_bytes, mime_type, variant, deadline_at)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                await asyncio.sleep(self._retry_wait(attempt, e, deadline_at))
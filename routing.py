@@ -0,0 +1,380 @@
+"""
+Model and thinking-budget routing with validation-driven escalation.
+
+Most bills are short: a one-page receipt with a handful of line items does
+not need the heaviest model with an unlimited thinking budget.
+``RoutingExtractor`` reads cheap document features (page count, file size
+and whether a PDF has a text layer) and sends simple documents to a light
+tier: a faster model with a small thinking budget and output limit.
+Everything else goes to the heavy tier.
+
+A light result is accepted only if it validates: the response parses, every
+line item has all required fields, and ``qty`` x ``price`` matches
+``billsParticularsCostCenterAmount`` (optionally less ``discount``) on
+most rows where all three are numbers. Otherwise the document is escalated
+to the heavy tier. Every decision, its reason, the call time and any
+escalation are recorded (see ``metrics.record_routing()``), so the latency
+saved and the escalation rate can be read from ``/metrics`` and ``/stats``.
+
+Both tiers share one deadline per call. The light tier has a shorter
+deadline of its own and does not retry invalid (usually truncated) JSON, so
+a failed light attempt leaves time to escalate. Any light tier error other
+than a 429 is escalated too; quota errors go to the caller that owns the
+quota.
+
+Page-chunked extraction calls the extractor once per page range. Wrap it in
+``document()`` so every range is routed on the features of the whole
+document rather than those of its own pages.
+"""
+import asyncio
+import contextvars
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+import textlayer
+from documents import try_page_count
+from extractor import COMPACT_FIELDS, RESPONSE_SCHEMA, Extractor, error_status, schema_fingerprint
+from resilience import DeadlineExceeded, InvalidResponse, deadline_scope
+
+REQUIRED_FIELDS = RESPONSE_SCHEMA["properties"]["line_details1"]["items"]["required"]
+
+# Relative difference at which an amount no longer matches qty x price
+ARITHMETIC_TOLERANCE = 0.01
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+# The document being extracted, set by ``document()``
+_document = contextvars.ContextVar("routing_document", default=None)
+
+
+@contextmanager
+def document(file_bytes, mime_type):
+    """
+    Routes every model call made within this block on ``file_bytes``.
+
+    Features are read at most once, on the first routed call, and shared by
+    the threads the calls run on.
+    """
+    token = _document.set({"bytes": file_bytes, "mime_type": mime_type, "features": None, "lock": threading.Lock()})
+    try:
+        yield
+    finally:
+        _document.reset(token)
+
+
+def parse_amount(text):
+    """Reads the number in a printed amount such as ``"PHP 1,200.00"``; None when there is none."""
+    if not isinstance(text, str):
+        return None
+    match = _NUMBER.search(text.replace(",", ""))
+    return float(match.group()) if match else None
+
+
+def arithmetic_ok(values):
+    """
+    Checks ``qty`` x ``price`` against the line amount.
+
+    Args:
+        values (dict): Field name to printed value for one line item.
+    Returns:
+        bool: Whether the amount is plausible, or None when the row cannot
+        be checked (e.g. a total row without quantity or price).
+    """
+    qty = parse_amount(values.get("qty"))
+    price = parse_amount(values.get("price"))
+    amount = parse_amount(values.get("billsParticularsCostCenterAmount"))
+    if qty is None or price is None or amount is None or qty == 0:
+        return None
+    tolerance = max(ARITHMETIC_TOLERANCE * abs(amount), 0.01)
+    expected = qty * price
+    if abs(expected - amount) <= tolerance:
+        return True
+    # Some bills print the amount after the line discount
+    discount = parse_amount(values.get("discount")) or 0
+    return abs(expected - discount - amount) <= tolerance
+
+
+def _rows(data, variant):
+    """Returns the printed values of each line item, or None when a field is missing."""
+    if variant in ("compact", "text"):
+        rows = data.get("rows")
+        if not isinstance(rows, list):
+            return None
+        values = []
+        for row in rows:
+            v = row.get("v") if isinstance(row, dict) else None
+            if not isinstance(v, list) or len(v) != len(COMPACT_FIELDS):
+                return None
+            values.append(dict(zip(COMPACT_FIELDS, v)))
+        return values
+    items = data.get("line_details1")
+    if not isinstance(items, list):
+        return None
+    values = []
+    for item in items:
+        if not isinstance(item, dict):
+            return None
+        row = {}
+        for field in REQUIRED_FIELDS:
+            entry = item.get(field)
+            if not isinstance(entry, dict) or "value" not in entry:
+                return None
+            row[field] = entry["value"]
+        values.append(row)
+    return values
+
+
+def validate(result_text, variant="full", max_mismatch=0.2, allow_empty=False):
+    """
+    Decides whether a response is good enough to keep.
+
+    Args:
+        result_text (str): The model response.
+        variant (str): The prompt and schema pair it was produced with.
+        max_mismatch (float): Share of checkable rows allowed to fail the
+            amount arithmetic.
+        allow_empty (bool): Accept a response without line items, e.g. for
+            one page range of a longer document.
+    Returns:
+        dict: ``valid``, ``reason`` (``invalid_json``, ``missing_fields``,
+        ``no_items`` or ``arithmetic`` when invalid), ``items``, ``checked``
+        and ``mismatched``.
+    """
+    report = {"valid": False, "reason": None, "items": 0, "checked": 0, "mismatched": 0}
+    try:
+        data = json.loads(result_text)
+    except ValueError:
+        report["reason"] = "invalid_json"
+        return report
+    rows = _rows(data, variant) if isinstance(data, dict) else None
+    if rows is None:
+        report["reason"] = "missing_fields"
+        return report
+    report["items"] = len(rows)
+    if not rows and not allow_empty:
+        # A bill always has at least a total; an empty answer is a miss
+        report["reason"] = "no_items"
+        return report
+    checks = [ok for ok in (arithmetic_ok(row) for row in rows) if ok is not None]
+    report["checked"] = len(checks)
+    report["mismatched"] = checks.count(False)
+    if checks and report["mismatched"] / len(checks) > max_mismatch:
+        report["reason"] = "arithmetic"
+        return report
+    report["valid"] = True
+    return report
+
+
+def features(file_bytes, mime_type, max_pages=None):
+    """
+    Reads the document features routing decides on.
+
+    Args:
+        file_bytes (bytes): The raw document contents.
+        mime_type (str): The MIME type of the document.
+        max_pages (int): Skip the text layer check for PDFs longer than this,
+            since they are routed by page count alone.
+    Returns:
+        dict: ``pages`` (None when unknown), ``bytes`` and ``text_layer``.
+    """
+    pdf = mime_type == "application/pdf"
+    pages = try_page_count(file_bytes) if pdf else 1
+    text_layer = False
+    if pdf and pages is not None and (max_pages is None or pages <= max_pages):
+        try:
+            text_layer = textlayer.has_text_layer(file_bytes)
+        except Exception:
+            text_layer = False
+    return {"pages": pages, "bytes": len(file_bytes), "text_layer": text_layer}
+
+
+class RoutingExtractor(Extractor):
+    """
+    Sends simple documents to a light tier and escalates failed results.
+
+    Args:
+        light (Extractor): Faster, cheaper configuration for simple documents.
+        heavy (Extractor): Configuration for everything else and for
+            escalations.
+        light_max_pages (int): Longest document the light tier gets.
+        light_max_bytes (int): Largest document the light tier gets.
+        max_mismatch (float): Share of rows allowed to fail the amount
+            arithmetic before a light result is escalated.
+        deadline (float): Seconds a call may take across both tiers; 0 for
+            no shared deadline.
+    """
+
+    def __init__(self, light, heavy, light_max_pages=2, light_max_bytes=2 * 1024 * 1024, max_mismatch=0.2,
+                 deadline=0):
+        self.light = light
+        self.heavy = heavy
+        self.model = heavy.model
+        self.deadline = deadline
+        self.light_max_pages = light_max_pages
+        self.light_max_bytes = light_max_bytes
+        self.max_mismatch = max_mismatch
+        self._lock = threading.Lock()
+        self.counters = {
+            'calls': 0,
+            'light': 0,
+            'heavy': 0,
+            'escalations': 0,
+            'light_seconds': 0.0,
+            'heavy_seconds': 0.0,
+            'escalated_seconds': 0.0,
+        }
+
+    def fingerprint(self, variant="full"):
+        policy = f"{self.light_max_pages}:{self.light_max_bytes}:{self.max_mismatch}"
+        return schema_fingerprint(self.light.fingerprint(variant), policy, self.heavy.fingerprint(variant))
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        light = stats['light']
+        stats['escalation_rate'] = round(stats['escalations'] / light, 4) if light else 0.0
+        # Mean model call time of documents that finished on each path
+        calls = {'light': light - stats['escalations'], 'heavy': stats['heavy'], 'escalated': stats['escalations']}
+        for path, count in calls.items():
+            seconds = stats.pop(f'{path}_seconds')
+            stats[f'{path}_mean_s'] = round(seconds / count, 3) if count else None
+        stats['light_tier'] = self.light.stats()
+        stats['heavy_tier'] = self.heavy.stats()
+        return stats
+
+    def choose(self, document):
+        """
+        Picks a tier for a document.
+
+        Args:
+            document (dict): Features from ``features()``.
+        Returns:
+            tuple: ``(tier, reason)`` with tier ``"light"`` or ``"heavy"``.
+        """
+        pages = document['pages']
+        if pages is None or pages > self.light_max_pages:
+            return "heavy", "pages"
+        if document['bytes'] > self.light_max_bytes:
+            return "heavy", "size"
+        if pages > 1 and not document['text_layer']:
+            # Multi-page scans are where the light tier misses rows
+            return "heavy", "scanned"
+        return "light", "text_layer" if document['text_layer'] else "single_page"
+
+    def _features(self, file_bytes, mime_type):
+        scope = _document.get()
+        if scope is None:
+            return features(file_bytes, mime_type, self.light_max_pages), False
+        with scope["lock"]:
+            if scope["features"] is None:
+                scope["features"] = features(scope["bytes"], scope["mime_type"], self.light_max_pages)
+        return scope["features"], file_bytes is not scope["bytes"]
+
+    def route(self, file_bytes, mime_type):
+        """
+        Picks the tier for one call.
+
+        Returns:
+            dict: The document features plus ``tier``, ``reason`` and
+            ``part`` (whether the call covers only part of the document).
+        """
+        with metrics.timed('route'):
+            document, part = self._features(file_bytes, mime_type)
+            tier, reason = self.choose(document)
+        self._count('calls')
+        self._count(tier)
+        return dict(document, tier=tier, reason=reason, part=part)
+
+    def _finish(self, decision, started, check=None):
+        decision['seconds'] = round(time.monotonic() - started, 4)
+        if check is not None:
+            decision['validation'] = check
+        if decision.get('escalated'):
+            self._count('escalated_seconds', decision['seconds'])
+        else:
+            self._count(f"{decision['tier']}_seconds", decision['seconds'])
+        metrics.record_routing(decision)
+
+    def _check(self, decision, variant, result_text=None, error=None):
+        """Validates a light tier result, or turns its error into a failed check."""
+        if isinstance(error, DeadlineExceeded):
+            return {"valid": False, "reason": "deadline"}
+        if isinstance(error, InvalidResponse):
+            # Invalid JSON is not retried on the light tier; usually the output limit truncated it
+            return {"valid": False, "reason": "invalid_json"}
+        if error is not None:
+            # E.g. a 503 after retries, or the light model missing in this location
+            return {"valid": False, "reason": "error", "error": type(error).__name__}
+        return validate(result_text, variant, self.max_mismatch, allow_empty=decision['part'])
+
+    def _escalate(self, decision, check):
+        decision['escalated'] = check['reason']
+        self._count('escalations')
+
+    def stream(self, file_bytes, mime_type, variant="full"):
+        """
+        Streams from the chosen tier.
+
+        Text handed to the caller cannot be taken back, so streamed results
+        are not validated or escalated.
+        """
+        decision = self.route(file_bytes, mime_type)
+        tier = self.light if decision['tier'] == "light" else self.heavy
+        started = time.monotonic()
+        try:
+            yield from tier.stream(file_bytes, mime_type, variant)
+        finally:
+            self._finish(decision, started)
+
+    def generate(self, file_bytes, mime_type, variant="full"):
+        decision = self.route(file_bytes, mime_type)
+        started = time.monotonic()
+        check = None
+        with deadline_scope(self.deadline):
+            if decision['tier'] == "light":
+                try:
+                    result_text = self.light.generate(file_bytes, mime_type, variant)
+                    check = self._check(decision, variant, result_text)
+                except Exception as e:
+                    if error_status(e) == 429:
+                        # Quota is owned by the caller (the engine backs off on it)
+                        raise
+                    check = self._check(decision, variant, error=e)
+                if check['valid']:
+                    self._finish(decision, started, check)
+                    return result_text
+                self._escalate(decision, check)
+            result_text = self.heavy.generate(file_bytes, mime_type, variant)
+        self._finish(decision, started, check)
+        return result_text
+
+    async def agenerate(self, file_bytes, mime_type, variant="full"):
+        # Reading the text layer parses the PDF, so keep it off the event loop
+        decision = await asyncio.to_thread(self.route, file_bytes, mime_type)
+        started = time.monotonic()
+        check = None
+        with deadline_scope(self.deadline):
+            if decision['tier'] == "light":
+                try:
+                    result_text = await self.light.agenerate(file_bytes, mime_type, variant)
+                    check = self._check(decision, variant, result_text)
+                except Exception as e:
+                    if error_status(e) == 429:
+                        # Quota is owned by the caller (the engine backs off on it)
+                        raise
+                    check = self._check(decision, variant, error=e)
+                if check['valid']:
+                    self._finish(decision, started, check)
+                    return result_text
+                self._escalate(decision, check)
+            result_text = await self.heavy.agenerate(file_bytes, mime_type, variant)
+        self._finish(decision, started, check)
+        return result_text
@@ -15,6 +15,8 @@ const closePdfBtn = document.getElementById('closePdfBtn');
 let pdfDoc = null;
 let pdfPage = null;
 let boundingBoxes = []; // Array of arrays, each containing bounding boxes for a line item
+let lineItemPages = []; // 1-based page number of each line item (page-chunked results carry pageIndex)
+let currentPageNum = 1;
 let selectedLineItems = new Set(); // Track which line items are selected
 
 // Tag label mappings for better display
@@ -125,6 +127,7 @@ async function renderPdfPage(pageNum) {
     
     try {
         pdfPage = await pdfDoc.getPage(pageNum);
+        currentPageNum = pageNum;
         
         // Render PDF at 100% scale (actual size)
         const scale = 1.0;
@@ -166,6 +169,7 @@ function drawBoundingBoxes(viewport) {
     // Only draw bounding boxes for selected line items
     selectedLineItems.forEach(lineItemIndex => {
         if (!boundingBoxes[lineItemIndex]) return;
+        if (lineItemPages[lineItemIndex] !== currentPageNum) return;
         
         const lineItemBboxes = boundingBoxes[lineItemIndex];
         const color = colors[lineItemIndex % colors.length];
@@ -201,9 +205,9 @@ function toggleLineItemBoundingBoxes(lineItemIndex, isChecked) {
         selectedLineItems.delete(lineItemIndex);
     }
     
-    // Redraw PDF with updated bounding boxes
+    // Redraw PDF with updated bounding boxes, switching to the item's page when it is shown
     if (pdfDoc && pdfPage) {
-        renderPdfPage(1);
+        renderPdfPage(isChecked ? lineItemPages[lineItemIndex] : currentPageNum);
     }
 }
 
@@ -216,6 +220,8 @@ function closePdfViewer() {
     pdfDoc = null;
     pdfPage = null;
     boundingBoxes = [];
+    lineItemPages = [];
+    currentPageNum = 1;
     if (pdfCanvas) {
         const ctx = pdfCanvas.getContext('2d');
         ctx.clearRect(0, 0, pdfCanvas.width, pdfCanvas.height);
@@ -246,8 +252,8 @@ function handleSubmit() {
     const formData = new FormData();
     formData.append('file', selectedFile);
     
-    // Send request
-    fetch('/upload', {
+    // Send request; line items are streamed back as Server-Sent Events
+    fetch('/upload/stream', {
         method: 'POST',
         body: formData
     })
@@ -257,10 +263,11 @@ function handleSubmit() {
                 throw new Error(data.error || 'An error occurred while processing the file.');
             });
         }
-        return response.json();
+        clearResults();
+        return readEventStream(response, handleStreamEvent);
     })
-    .then(data => {
-        displayResults(data);
+    .then(() => {
+        finishResults();
         submitBtn.classList.remove('loading');
         submitBtn.disabled = false;
     })
@@ -271,56 +278,101 @@ function handleSubmit() {
     });
 }
 
-function displayResults(data) {
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            
+            let eventName = 'message';
+            const dataLines = [];
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) {
+                    eventName = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    dataLines.push(line.slice(5).trim());
+                }
+            });
+            if (dataLines.length > 0) {
+                onEvent(eventName, JSON.parse(dataLines.join('\n')));
+            }
+        }
+    }
+}
+
+function handleStreamEvent(eventName, data) {
+    if (eventName === 'item') {
+        appendLineItem(data.item);
+    } else if (eventName === 'error') {
+        throw new Error(data.error || 'An error occurred while processing the file.');
+    }
+}
+
+function clearResults() {
     resultsContainer.innerHTML = '';
     boundingBoxes = [];
+    lineItemPages = [];
     selectedLineItems.clear();
+}
+
+function appendLineItem(item) {
+    const index = boundingBoxes.length;
+    const lineItemBboxes = [];
     
-    if (!data.line_details1 || !Array.isArray(data.line_details1) || data.line_details1.length === 0) {
-        resultsContainer.innerHTML = '<p style="text-align: center; color: #a0a0a0; padding: 40px;">No line items found in the document.</p>';
-        resultsSection.style.display = 'block';
-        return;
-    }
-    
-    // Collect bounding boxes per line item
-    data.line_details1.forEach((item, index) => {
-        const lineItemBboxes = [];
-        
-        // Extract bounding boxes from item
-        Object.keys(tagLabels).forEach(key => {
-            if (item[key] && typeof item[key] === 'object') {
-                const field = item[key];
-                // Add label bounding box
-                if (field.labelBbox && Array.isArray(field.labelBbox) && field.labelBbox.length === 4) {
-                    lineItemBboxes.push({
-                        bbox: field.labelBbox,
-                        label: tagLabels[key] + ' (Label)',
-                        type: 'label',
-                        fieldKey: key
-                    });
-                }
-                // Add value bounding box
-                if (field.valueBbox && Array.isArray(field.valueBbox) && field.valueBbox.length === 4) {
-                    lineItemBboxes.push({
-                        bbox: field.valueBbox,
-                        label: tagLabels[key] + (field.value ? `: ${field.value}` : ''),
-                        type: 'value',
-                        fieldKey: key
-                    });
-                }
+    // Extract bounding boxes from item
+    Object.keys(tagLabels).forEach(key => {
+        if (item[key] && typeof item[key] === 'object') {
+            const field = item[key];
+            // Add label bounding box
+            if (field.labelBbox && Array.isArray(field.labelBbox) && field.labelBbox.length === 4) {
+                lineItemBboxes.push({
+                    bbox: field.labelBbox,
+                    label: tagLabels[key] + ' (Label)',
+                    type: 'label',
+                    fieldKey: key
+                });
             }
-        });
-        
-        boundingBoxes.push(lineItemBboxes);
-        
-        // Create line item element with checkbox
-        const lineItemDiv = createLineItemElement(item, index + 1, index);
-        resultsContainer.appendChild(lineItemDiv);
+            // Add value bounding box
+            if (field.valueBbox && Array.isArray(field.valueBbox) && field.valueBbox.length === 4) {
+                lineItemBboxes.push({
+                    bbox: field.valueBbox,
+                    label: tagLabels[key] + (field.value ? `: ${field.value}` : ''),
+                    type: 'value',
+                    fieldKey: key
+                });
+            }
+        }
     });
     
+    boundingBoxes.push(lineItemBboxes);
+    lineItemPages.push(Number.isInteger(item.pageIndex) ? item.pageIndex + 1 : 1);
+    
+    // Create line item element with checkbox
+    const lineItemDiv = createLineItemElement(item, index + 1, index);
+    resultsContainer.appendChild(lineItemDiv);
+    
+    // Show results as soon as the first line item arrives
+    resultsSection.style.display = 'block';
+}
+
+function finishResults() {
+    if (boundingBoxes.length === 0) {
+        resultsContainer.innerHTML = '<p style="text-align: center; color: #a0a0a0; padding: 40px;">No line items found in the document.</p>';
+    }
+    
     // Redraw PDF with bounding boxes if PDF is already loaded
     if (pdfDoc) {
-        renderPdfPage(1);
+        renderPdfPage(currentPageNum);
     }
     
     resultsSection.style.display = 'block';
@@ -333,7 +385,7 @@ window.addEventListener('resize', () => {
     clearTimeout(resizeTimeout);
     resizeTimeout = setTimeout(() => {
         if (pdfDoc) {
-            renderPdfPage(1);
+            renderPdfPage(currentPageNum);
         }
     }, 250);
 });
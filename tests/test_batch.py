@@ -0,0 +1,48 @@
+import json
+
+import batch
+
+
+def records(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run(paths, output, process=lambda path: {"path": path}, **kwargs):
+    return batch.run_batch(paths, process, str(output), concurrency=2, log=None, **kwargs)
+
+
+def test_resume_skips_successful_documents(tmp_path):
+    output = tmp_path / "out.jsonl"
+    seen = []
+
+    def flaky(path):
+        seen.append(path)
+        if path == "b" and seen.count("b") == 1:
+            raise RuntimeError("boom")
+        return {}
+
+    assert run(["a", "b"], output, flaky) == {"ok": 1, "error": 1, "skipped": 0}
+    assert run(["a", "b"], output, flaky) == {"ok": 1, "error": 0, "skipped": 1}
+    assert sorted(seen) == ["a", "b", "b"]
+    assert batch.load_completed(str(output)) == {"a", "b"}
+
+
+def test_resume_after_partial_last_line(tmp_path):
+    output = tmp_path / "out.jsonl"
+    output.write_text('{"path": "a", "status": "ok"}\n{"path": "b", "status": "o', encoding="utf-8")
+
+    assert run(["a", "b"], output) == {"ok": 1, "error": 0, "skipped": 1}
+    lines = output.read_text(encoding="utf-8").splitlines()
+    assert lines[1] == '{"path": "b", "status": "o'
+    assert json.loads(lines[2])["path"] == "b"
+    assert batch.load_completed(str(output)) == {"a", "b"}
+    # Nothing is sent again on the next run
+    assert run(["a", "b"], output)["skipped"] == 2
+
+
+def test_without_resume_every_document_is_processed(tmp_path):
+    output = tmp_path / "out.jsonl"
+    run(["a"], output)
+    assert run(["a"], output, resume=False) == {"ok": 1, "error": 0, "skipped": 0}
+    assert [r["path"] for r in records(output)] == ["a", "a"]
@@ -0,0 +1,61 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+import bboxes  # noqa: E402
+from extractor import LINE_ITEM_FIELDS  # noqa: E402
+
+HEADER = [40, 100, 60, 400]
+
+
+def field(box, value="x"):
+    return {"value": value, "labelBbox": [0, 0, 0, 0], "valueBbox": list(box)}
+
+
+def row(y, **extra):
+    """A line item on the row starting at ``y``, under a shared section header."""
+    item = {name: field([0, 0, 0, 0], "") for name in LINE_ITEM_FIELDS}
+    item["sectionHeaderLineSectionType"] = field(HEADER, "Laboratory")
+    item["serviceDateTime"] = field(HEADER, "01-02-2024")
+    item["billsParticularsCostCenters"] = field([y, 100, y + 10, 400], "CBC")
+    item["qty"] = field([y, 600, y + 10, 620], "1")
+    item["price"] = field([y, 700, y + 10, 760], "450.00")
+    item["billsParticularsCostCenterAmount"] = field([y, 820, y + 10, 880], "450.00")
+    item.update(extra)
+    return item
+
+
+def test_dedupe_is_off_by_default():
+    items = [row(100, pageIndex=0), row(100, pageIndex=0)]
+    result = bboxes.postprocess({"line_details1": items})
+    assert len(result["line_details1"]) == 2
+
+
+def test_items_without_page_are_not_deduplicated():
+    # The same table layout on two pages, without a page field
+    items = [row(100), row(200), row(100), row(200)]
+    result = bboxes.postprocess({"line_details1": items}, iou_threshold=0.9)
+    assert len(result["line_details1"]) == 4
+
+
+def test_rows_sharing_header_boxes_are_kept():
+    items = [row(100, pageIndex=0), row(115, pageIndex=0), row(130, pageIndex=0)]
+    result = bboxes.postprocess({"line_details1": items}, iou_threshold=0.9)
+    assert len(result["line_details1"]) == 3
+
+
+def test_repeated_row_on_same_page_is_dropped():
+    items = [row(100, pageIndex=0), row(100, pageIndex=0), row(100, pageIndex=1)]
+    result = bboxes.postprocess({"line_details1": items}, iou_threshold=0.9, report=True)
+    assert [item["pageIndex"] for item in result["line_details1"]] == [0, 1]
+    assert result["validation"]["duplicates"] == [1]
+
+
+def test_validation_report_only_when_requested():
+    items = [row(100)]
+    items[0]["qty"] = field([120, 600, 110, 620], "1")
+    assert "validation" not in bboxes.postprocess({"line_details1": items})
+
+    result = bboxes.postprocess({"line_details1": items}, report=True)
+    assert result["validation"]["inverted"] == 1
+    assert result["line_details1"][0]["qty"]["valueBbox"] == [110, 600, 120, 620]
@@ -0,0 +1,74 @@
+import io
+
+import pytest
+
+pypdf = pytest.importorskip("pypdf")
+
+from pypdf.generic import (  # noqa: E402
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    FloatObject,
+    NameObject,
+    NumberObject,
+)
+
+import preflight  # noqa: E402
+
+
+def stream(writer, data, **entries):
+    obj = DecodedStreamObject()
+    obj.set_data(data)
+    obj.update({NameObject(key): value for key, value in entries.items()})
+    return writer._add_object(obj)
+
+
+def xobjects(**refs):
+    return DictionaryObject({
+        NameObject("/XObject"): DictionaryObject({NameObject("/" + k): v for k, v in refs.items()}),
+    })
+
+
+def image(writer, gray):
+    return stream(writer, bytes([gray]) * 4, **{
+        "/Type": NameObject("/XObject"), "/Subtype": NameObject("/Image"),
+        "/Width": NumberObject(2), "/Height": NumberObject(2),
+        "/ColorSpace": NameObject("/DeviceGray"), "/BitsPerComponent": NumberObject(8),
+    })
+
+
+def form_page(writer, gray):
+    """A page drawing ``/Fm0``, which in turn draws an image of the given shade."""
+    form = stream(writer, b"q 100 0 0 100 0 0 cm /Im0 Do Q", **{
+        "/Type": NameObject("/XObject"), "/Subtype": NameObject("/Form"),
+        "/BBox": ArrayObject([FloatObject(0), FloatObject(0), FloatObject(100), FloatObject(100)]),
+        "/Resources": xobjects(Im0=image(writer, gray)),
+    })
+    page = writer.add_blank_page(100, 100)
+    page[NameObject("/Resources")] = xobjects(Fm0=form)
+    page[NameObject("/Contents")] = stream(writer, b"/Fm0 Do")
+    return page
+
+
+def render(writer):
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def test_pages_with_different_form_contents_are_kept():
+    writer = pypdf.PdfWriter()
+    form_page(writer, 0)
+    form_page(writer, 128)
+    _, kept, report = preflight.preflight(render(writer), drop_blank=False)
+    assert kept == [0, 1]
+    assert report["duplicate_pages"] == []
+
+
+def test_identical_pages_are_dropped():
+    writer = pypdf.PdfWriter()
+    form_page(writer, 0)
+    form_page(writer, 0)
+    _, kept, report = preflight.preflight(render(writer), drop_blank=False)
+    assert kept == [0]
+    assert report["duplicate_pages"] == [1]
@@ -0,0 +1,268 @@
+"""
+Text-layer fast path for born-digital PDFs.
+
+When a PDF carries a usable text layer, the model is asked for values only
+(the ``text`` variant) and every value and label is located in the page's
+own word geometry, which is both cheaper than having the model emit boxes
+and more precise. The result has exactly the ``line_details1`` shape of the
+full schema, plus a 0-based ``pageIndex`` per item.
+
+Word boxes come from PyMuPDF, so the fast path needs it installed.
+``pypdf`` reports text positions per line rather than per word, which puts
+every column of a table next to its first one. Without PyMuPDF
+``available()`` is False and documents take the regular path.
+``has_text_layer()`` only counts words and works with ``pypdf`` alone.
+"""
+import re
+from collections import defaultdict
+
+from compact import expand_row
+from extractor import COMPACT_FIELDS
+from documents import open_pdf
+
+try:
+    import pymupdf
+except ImportError:  # pragma: no cover - optional dependency
+    try:
+        import fitz as pymupdf
+    except ImportError:
+        pymupdf = None
+
+SCALE = 1000
+
+# A page needs this many words for its text layer to count as usable
+MIN_WORDS_PER_PAGE = 10
+# Share of pages that must have a usable text layer
+MIN_TEXT_PAGES = 0.8
+
+# Fields the model classifies rather than copies, so they have no box to find
+UNPRINTED_FIELDS = {"lineTypeSectionTotalItem"}
+
+_STRIP = "()[]{}:;,\"'"
+_THOUSANDS = re.compile(r"(?<=\d),(?=\d{3}\b)")
+
+
+def available():
+    """Whether PyMuPDF is installed."""
+    return pymupdf is not None
+
+
+def normalize(text):
+    """Lowercases a token, drops surrounding punctuation and thousands separators."""
+    return _THOUSANDS.sub("", text.lower()).strip(_STRIP)
+
+
+def tokens(text):
+    return [token for token in (normalize(part) for part in text.split()) if token]
+
+
+class PageWords:
+    """
+    Words of one page with an index from normalized token to position.
+
+    Args:
+        width (float): Page width in points.
+        height (float): Page height in points.
+        words (list): ``(x0, y0, x1, y1, text)`` tuples with a top-left
+            origin, in reading order.
+    """
+
+    def __init__(self, width, height, words):
+        self.width = width
+        self.height = height
+        self.words = words
+        self.tokens = [normalize(word[4]) for word in words]
+        self.index = defaultdict(list)
+        for position, token in enumerate(self.tokens):
+            if token:
+                self.index[token].append(position)
+
+    def find(self, text):
+        """
+        Finds every occurrence of ``text`` as a run of consecutive words.
+
+        Returns:
+            list: ``(x0, y0, x1, y1)`` boxes enclosing each occurrence.
+        """
+        wanted = tokens(text)
+        if not wanted:
+            return []
+        matches = []
+        for start in self.index.get(wanted[0], ()):
+            end = start + len(wanted)
+            if self.tokens[start:end] == wanted:
+                run = self.words[start:end]
+                matches.append((
+                    min(w[0] for w in run), min(w[1] for w in run),
+                    max(w[2] for w in run), max(w[3] for w in run),
+                ))
+        if not matches and len(wanted) > 1:
+            # The text layer may hold the value as one word, e.g. "PHP1,200.00"
+            joined = "".join(wanted)
+            matches = [self.words[i][:4] for i in self.index.get(joined, ())]
+        return matches
+
+    def normalized(self, box):
+        """Converts a point box to ``[y_min, x_min, y_max, x_max]`` on the 0-1000 scale."""
+        x0, y0, x1, y1 = box
+        return [
+            round(y0 / self.height * SCALE), round(x0 / self.width * SCALE),
+            round(y1 / self.height * SCALE), round(x1 / self.width * SCALE),
+        ]
+
+
+def _pymupdf_pages(pdf_bytes):
+    pages = []
+    with pymupdf.open(stream=pdf_bytes, filetype="pdf") as document:
+        for page in document:
+            words = [(w[0], w[1], w[2], w[3], w[4]) for w in page.get_text("words", sort=True)]
+            pages.append(PageWords(page.rect.width, page.rect.height, words))
+    return pages
+
+
+def extract_words(pdf_bytes):
+    """
+    Reads the word geometry of every page. Needs PyMuPDF.
+
+    Returns:
+        list: One ``PageWords`` per page.
+    """
+    return _pymupdf_pages(pdf_bytes)
+
+
+def _enough_text(word_counts):
+    if not word_counts:
+        return False
+    with_text = sum(1 for count in word_counts if count >= MIN_WORDS_PER_PAGE)
+    return with_text / len(word_counts) >= MIN_TEXT_PAGES
+
+
+def usable(pages):
+    """Whether enough pages have a text layer to resolve boxes from it."""
+    return _enough_text([len(page.words) for page in pages])
+
+
+def has_text_layer(pdf_bytes):
+    """
+    Whether enough pages of a PDF carry text, without reading word geometry.
+
+    Uses PyMuPDF when installed and ``pypdf`` otherwise.
+    """
+    if pymupdf is not None:
+        return usable(_pymupdf_pages(pdf_bytes))
+    return _enough_text([len(page.extract_text().split()) for page in open_pdf(pdf_bytes).pages])
+
+
+def _center_y(box):
+    return (box[1] + box[3]) / 2
+
+
+def _center_x(box):
+    return (box[0] + box[2]) / 2
+
+
+def _column_x(page, label, row_y):
+    """Horizontal center of the closest occurrence of ``label`` above the row, if any."""
+    above = [box for box in page.find(label) if _center_y(box) < row_y] if label.strip() else []
+    if not above:
+        return None
+    return _center_x(max(above, key=_center_y))
+
+
+def _closest(candidates, row_y, line_height, column_x, used):
+    """
+    Picks the occurrence on the row's line, preferring the one under the
+    field's column header and not already taken by another field.
+    """
+    options = [box for box in candidates if box not in used] or candidates
+
+    def key(box):
+        line_offset = round(abs(_center_y(box) - row_y) / line_height)
+        column_offset = abs(_center_x(box) - column_x) if column_x is not None else 0
+        return line_offset, column_offset
+    return min(options, key=key)
+
+
+def _label_box(page, label, value_box):
+    """The occurrence of ``label`` above the value (a column header) or to its left."""
+    best = None
+    best_distance = None
+    for box in page.find(label):
+        if box[3] <= value_box[1] + 1:
+            # Column header: prefer headers straight above the value
+            distance = (value_box[1] - box[3]) + abs((box[0] + box[2]) / 2 - (value_box[0] + value_box[2]) / 2)
+        elif box[2] <= value_box[0] + 1 and abs(_center_y(box) - _center_y(value_box)) < (value_box[3] - value_box[1]):
+            distance = value_box[0] - box[2]
+        else:
+            continue
+        if best is None or distance < best_distance:
+            best, best_distance = box, distance
+    return best
+
+
+def resolve(result, pages):
+    """
+    Turns a ``text`` variant response into full line items.
+
+    For each row the most distinctive value (fewest occurrences on its page)
+    fixes the row's vertical position, taking the first occurrence below the
+    previous row on that page since rows are listed in document order. The
+    other values use the occurrence on that line, under their column header
+    when the same text appears more than once, and labels the nearest
+    occurrence above or left of their value.
+
+    Args:
+        result (dict): Parsed response with ``labels`` and ``rows``.
+        pages (list): ``PageWords`` per page, from ``extract_words()``.
+    Returns:
+        tuple: ``(result, stats)``. ``result`` is ``{"line_details1": [...]}``
+        with a ``pageIndex`` per item; ``stats`` counts matched and
+        unmatched values.
+    """
+    labels = list(result.get("labels") or [])
+    labels += [""] * (len(COMPACT_FIELDS) - len(labels))
+    row_cursor = defaultdict(float)
+    stats = {"values": 0, "matched": 0, "labels_matched": 0}
+    items = []
+    for row in result.get("rows") or []:
+        values = list(row.get("v") or [])
+        values += [""] * (len(COMPACT_FIELDS) - len(values))
+        page_number = row.get("p")
+        page_index = page_number - 1 if isinstance(page_number, int) and 0 < page_number <= len(pages) else 0
+        page = pages[page_index]
+
+        candidates = {}
+        for i, value in enumerate(values[:len(COMPACT_FIELDS)]):
+            if value.strip() and COMPACT_FIELDS[i] not in UNPRINTED_FIELDS:
+                stats["values"] += 1
+                found = page.find(value)
+                if found:
+                    candidates[i] = found
+
+        boxes = {}
+        if candidates:
+            anchor = min(candidates, key=lambda i: (len(candidates[i]), -len(values[i])))
+            below = [box for box in candidates[anchor] if _center_y(box) >= row_cursor[page_index]]
+            boxes[anchor] = min(below or candidates[anchor], key=_center_y)
+            row_y = _center_y(boxes[anchor])
+            line_height = max(1.0, boxes[anchor][3] - boxes[anchor][1])
+            row_cursor[page_index] = row_y
+            # Fields with fewer occurrences first, so ambiguous values pick from what is left
+            for i in sorted(candidates, key=lambda i: len(candidates[i])):
+                if i != anchor:
+                    column_x = _column_x(page, labels[i], row_y)
+                    boxes[i] = _closest(candidates[i], row_y, line_height, column_x, boxes.values())
+
+        flat = []
+        for i in range(len(COMPACT_FIELDS)):
+            value_box = boxes.get(i)
+            label_box = _label_box(page, labels[i], value_box) if value_box and labels[i].strip() else None
+            flat += page.normalized(label_box) if label_box else [0, 0, 0, 0]
+            flat += page.normalized(value_box) if value_box else [0, 0, 0, 0]
+            stats["matched"] += value_box is not None
+            stats["labels_matched"] += label_box is not None
+
+        item = expand_row({"v": values, "b": flat})
+        item["pageIndex"] = page_index
+        items.append(item)
+    return {"line_details1": items}, stats